@@ -0,0 +1,228 @@
+"""
+Approximate nearest-neighbour index for very large event galleries.
+Inverted-file (IVF) partitioning: face encodings are bucketed by their nearest k-means centroid and a
+query only scans the lists of its `nprobe` nearest centroids. Optionally the encodings are product-quantized
+(PQ) so lists are scanned with small lookup tables instead of full 128-d distances. PQ only prunes faces whose
+approximate distance minus their quantization error is beyond the threshold, which by the triangle inequality
+cannot match, and survivors are re-checked against the exact encodings: recall is lost only to unprobed lists,
+and results never contain faces beyond the threshold.
+Galleries smaller than ANN_MIN_FACES use exact search instead (see build_ann_index).
+
+tests/test_ann_index.py checks recall against exact threshold search; `python ann_index.py` benchmarks it.
+"""
+import os
+import sys
+import time
+import numpy as np
+
+ANN_ENABLED = os.getenv('ANN_INDEX', '0') == '1'
+ANN_MIN_FACES = int(os.getenv('ANN_MIN_FACES', '50000'))
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '16'))
+# Number of PQ sub-vectors (must divide 128); 0 keeps full vectors in the lists
+ANN_PQ_SUBVECTORS = int(os.getenv('ANN_PQ_SUBVECTORS', '0'))
+PQ_CENTROIDS = 256
+KMEANS_ITERATIONS = 15
+KMEANS_MAX_TRAINING = 100000
+# PQ codebooks only have PQ_CENTROIDS entries per sub-vector, so a smaller sample trains them well
+PQ_MAX_TRAINING = 32768
+# Rows processed at a time when assigning vectors to centroids, to bound memory
+ASSIGN_CHUNK = 16384
+
+def squared_distances(a, b):
+    """
+    Squared Euclidean distances between rows of a (n, d) and rows of b (m, d).
+    """
+    sq = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * a @ b.T
+    return np.maximum(sq, 0.0)
+
+def nearest_centroid(data, centroids):
+    """
+    Index of the nearest centroid for every row of data, computed in chunks.
+    """
+    out = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), ASSIGN_CHUNK):
+        out[start:start + ASSIGN_CHUNK] = squared_distances(data[start:start + ASSIGN_CHUNK], centroids).argmin(axis=1)
+    return out
+
+def kmeans(data, k, iterations=KMEANS_ITERATIONS, rng=None):
+    """
+    Plain Lloyd's k-means. Empty clusters are re-seeded with random points.
+    Returns:
+        np.ndarray: (k, d) centroids.
+    """
+    rng = rng or np.random.default_rng(0)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroid(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=col, minlength=k) for col in data.T], axis=1)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+class IVFIndex:
+    """
+    IVF (optionally IVF-PQ) index over row ids of an encodings array.
+    The raw encodings are not copied; pass them to range_search for the exact distance check.
+    """
+    def __init__(self, vectors, nlist=None, pq_subvectors=ANN_PQ_SUBVECTORS, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        rng = np.random.default_rng(seed)
+        n, dim = vectors.shape
+        self.nlist = int(nlist or max(min(int(4 * np.sqrt(n)), n), 1))
+        sample = vectors[rng.choice(n, min(n, KMEANS_MAX_TRAINING), replace=False)]
+        self.centroids = kmeans(sample, self.nlist, rng=rng)
+        self.nlist = len(self.centroids)
+        self.trained_size = n
+        self.pq_subvectors = pq_subvectors
+        self.codebooks = None
+        if pq_subvectors:
+            if dim % pq_subvectors:
+                raise ValueError(f"PQ sub-vectors ({pq_subvectors}) must divide the dimension ({dim}).")
+            pq_sample = sample[:PQ_MAX_TRAINING]
+            residuals = pq_sample - self.centroids[nearest_centroid(pq_sample, self.centroids)]
+            sub = dim // pq_subvectors
+            self.codebooks = np.stack([kmeans(residuals[:, m * sub:(m + 1) * sub], PQ_CENTROIDS, rng=rng)
+                                       for m in range(pq_subvectors)])
+        self.assignments = np.zeros(0, dtype=np.int64)
+        self.codes = np.zeros((0, pq_subvectors), dtype=np.uint8)
+        self.errors = np.zeros(0)  # Distance of each vector to its PQ reconstruction
+        self.add(vectors)
+
+    @property
+    def size(self):
+        return len(self.assignments)
+
+    def _encode(self, vectors, assignments):
+        """
+        Returns the PQ codes of vectors' residuals and each vector's reconstruction error.
+        """
+        residuals = vectors - self.centroids[assignments]
+        sub = residuals.shape[1] // self.pq_subvectors
+        codes = np.empty((len(vectors), self.pq_subvectors), dtype=np.uint8)
+        sq_error = np.zeros(len(vectors))
+        for m in range(self.pq_subvectors):
+            part = residuals[:, m * sub:(m + 1) * sub]
+            codes[:, m] = nearest_centroid(part, self.codebooks[m])
+            sq_error += ((part - self.codebooks[m][codes[:, m]]) ** 2).sum(axis=1)
+        return codes, np.sqrt(sq_error)
+
+    def add(self, new_vectors):
+        """
+        Appends vectors (row ids continue from the current size) without retraining the centroids.
+        """
+        new_vectors = np.asarray(new_vectors, dtype=np.float64)
+        if not len(new_vectors):
+            return
+        new_assignments = nearest_centroid(new_vectors, self.centroids)
+        self.assignments = np.concatenate([self.assignments, new_assignments])
+        if self.codebooks is not None:
+            codes, errors = self._encode(new_vectors, new_assignments)
+            self.codes = np.vstack([self.codes, codes])
+            self.errors = np.concatenate([self.errors, errors])
+        self._build_lists()
+
+    def keep(self, mask):
+        """
+        Drops the rows where mask is False; remaining row ids are renumbered like encodings[mask].
+        """
+        self.assignments = self.assignments[mask]
+        if self.codebooks is not None:
+            self.codes = self.codes[mask]
+            self.errors = self.errors[mask]
+        self._build_lists()
+
+    def _build_lists(self):
+        # Inverted lists: row ids grouped by centroid
+        self.list_ids = np.argsort(self.assignments, kind='stable')
+        self.list_offsets = np.searchsorted(self.assignments[self.list_ids], np.arange(self.nlist + 1))
+
+    def range_search(self, queries, threshold, vectors, nprobe=ANN_NPROBE):
+        """
+        Finds rows within threshold of any query, scanning the nprobe nearest lists per query.
+        nprobe >= nlist scans every list, i.e. exact search.
+        Args:
+            queries: (q, d) query encodings.
+            threshold (float): Match distance threshold.
+            vectors: The (n, d) encodings the index was built over, for the exact distance check.
+            nprobe (int): Lists scanned per query; higher means better recall and more work.
+        Returns:
+            tuple: (row ids, distance to the closest query), both np.ndarray.
+        """
+        queries = np.asarray(queries, dtype=np.float64)
+        nprobe = min(max(int(nprobe), 1), self.nlist)
+        best = {}
+        centroid_sq = squared_distances(queries, self.centroids)
+        for qi, query in enumerate(queries):
+            probe = np.argpartition(centroid_sq[qi], nprobe - 1)[:nprobe]
+            chunks = [self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe]
+            ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+            if not len(ids):
+                continue
+            if self.codebooks is not None:
+                # Asymmetric distance to each face's PQ reconstruction, from per-list lookup tables of the
+                # query residual to each PQ sub-centroid
+                list_of_id = np.repeat(np.arange(len(probe)), [len(c) for c in chunks])
+                sub = queries.shape[1] // self.pq_subvectors
+                approx = np.zeros(len(ids))
+                residuals = query[None, :] - self.centroids[probe]
+                for m in range(self.pq_subvectors):
+                    table = squared_distances(residuals[:, m * sub:(m + 1) * sub], self.codebooks[m])
+                    approx += table[list_of_id, self.codes[ids, m]]
+                # |q - x| >= |q - reconstruction| - |x - reconstruction|, so this never drops a match
+                ids = ids[np.sqrt(approx) - self.errors[ids] < threshold]
+                if not len(ids):
+                    continue
+            dists = np.sqrt(squared_distances(vectors[ids], query[None, :])[:, 0])
+            for i, d in zip(ids[dists < threshold].tolist(), dists[dists < threshold].tolist()):
+                if d < best.get(i, np.inf):
+                    best[i] = d
+        rows = np.fromiter(best.keys(), dtype=np.int64, count=len(best))
+        return rows, np.fromiter(best.values(), dtype=np.float64, count=len(best))
+
+def build_ann_index(vectors):
+    """
+    Builds an IVF index if ANN search is enabled and the gallery is large enough.
+    Returns:
+        IVFIndex or None: None means the caller should use exact search.
+    """
+    if not ANN_ENABLED or len(vectors) < ANN_MIN_FACES:
+        return None
+    start = time.time()
+    index = IVFIndex(vectors)
+    print(f"🧭 Built IVF{'-PQ' if index.codebooks is not None else ''} index: {index.size} faces, "
+          f"{index.nlist} lists in {time.time() - start:.1f}s.")
+    return index
+
+# --- Standalone benchmark: recall and latency per nprobe at 100k faces ---
+if __name__ == "__main__":
+    THRESHOLD = 0.45
+    rng = np.random.default_rng(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    identities, faces, dim = 5000, 100000, 128
+    # Synthetic encodings: identity centres ~0.9 apart, faces of one identity ~0.3 apart
+    centres = rng.normal(size=(identities, dim)) * (0.65 / np.sqrt(dim))
+    who = rng.integers(0, identities, faces)
+    gallery = centres[who] + rng.normal(size=(faces, dim)) * (0.22 / np.sqrt(dim))
+    query_ids = rng.choice(identities, 20, replace=False)
+    queries = [centres[q] + rng.normal(size=(5, dim)) * (0.22 / np.sqrt(dim)) for q in query_ids]
+
+    def exact(refs):
+        d = np.sqrt(squared_distances(gallery, refs)).min(axis=1)
+        return set(np.nonzero(d < THRESHOLD)[0].tolist())
+
+    truth = [exact(refs) for refs in queries]
+    print(f"{faces} faces, {sum(len(t) for t in truth)} exact matches over {len(queries)} requests")
+    for pq in (0, 16):
+        start = time.time()
+        index = IVFIndex(gallery, pq_subvectors=pq)
+        print(f"\nIVF{'-PQ' + str(pq) if pq else ''}: {index.nlist} lists, built in {time.time() - start:.1f}s")
+        for nprobe in (1, 4, 16, 64):
+            start = time.time()
+            found = [set(index.range_search(refs, THRESHOLD, gallery, nprobe)[0].tolist()) for refs in queries]
+            elapsed = (time.time() - start) / len(queries)
+            recall = sum(len(f & t) for f, t in zip(found, truth)) / max(sum(len(t) for t in truth), 1)
+            false_hits = sum(len(f - t) for f, t in zip(found, truth))
+            print(f"  nprobe={nprobe:<3} recall={recall:.4f} false_matches={false_hits} {elapsed * 1000:.1f} ms/request")
@@ -18,22 +18,34 @@ import uuid
 import threading
 import time
 import base64
+import cv2
+import numpy as np
+from scheduler import MatchScheduler, estimate_event_cost, parse_event_weights, POLICIES
+from result_storage import create_result_storage, LocalResultStorage, format_ttl
+from gallery_index import update_gallery_index
+from video_ingest import is_video_file, ingest_video, load_video_matches, format_timestamp
+from profiling import ProfilingControl, list_profiles, PROFILES_FOLDER, PROFILE_FILES, MODES
+from frame_store import FrameStore
 
 load_dotenv()
 
 app = Flask(__name__)
 
 MATCHED_FOLDER = 'static/matched'
+# Queued matching jobs each match into their own subfolder, so concurrent workers never share results
+REQUEST_MATCHED_FOLDER = 'static/matched_requests'
 GALLERY_FOLDER = 'static/gallery'
 EMAIL_FLAG_FILE = 'stored_email.txt'
 EMAIL_SENT_FLAG = 'email_sent.flag'
 UPLOAD_TMP_DIR = 'tmp_frames'
 os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
-# Clean up all old temp frame folders on startup
+# Clean up all old temp frame folders and spilled frame files on startup
 for folder in os.listdir(UPLOAD_TMP_DIR):
     folder_path = os.path.join(UPLOAD_TMP_DIR, folder)
     if os.path.isdir(folder_path):
         shutil.rmtree(folder_path, ignore_errors=True)
+    else:
+        os.remove(folder_path)
 
 # --- Mail configuration ---
 mail_server = os.getenv('MAIL_SERVER')
@@ -70,6 +82,9 @@ mail.init_app(app)
 app.secret_key = os.getenv('SECRET_KEY')  # Needed for session
 app.permanent_session_lifetime = timedelta(hours=2)
 
+# --- Result storage (RESULT_STORAGE=supabase|local) ---
+result_storage = create_result_storage(supabase, secret_key=app.secret_key)
+
 # --- Admin Authentication ---
 ADMIN_USERNAME = 'admin'
 ADMIN_PASSWORD = 'admin123'
@@ -153,74 +168,84 @@ def index():
     """
     return render_template('index.html')
 
-def process_pending_request_async():
+def process_matched_request(request_id, matched_folder=MATCHED_FOLDER):
     """
-    Background thread to process the most recent pending user request:
+    Delivers the results of a finished matching run for one user request:
     - Zips matched images
-    - Uploads to Supabase Storage
+    - Stores the zip with the configured result storage backend
     - Sends email with download link
     - Updates request status
+    Args:
+        request_id (str): The user request whose matches are in matched_folder.
+        matched_folder (str): Folder the request's matching run saved its matches to.
     """
-    def worker():
-        with app.app_context():
-            from time import sleep
-            sleep(2)
-            pending = supabase.table('user_requests').select('*').eq('status', 'pending').order('created_at', desc=True).limit(1).execute().data
-            if not pending:
-                print('DEBUG: No pending user_requests found')
-                return
-            req = pending[0]
-            request_id = req['id']
-            email = req['email']
-            MATCHED_FOLDER = 'static/matched'
-            matched_files = [f for f in os.listdir(MATCHED_FOLDER) if f.startswith('clean_')]
-            print('DEBUG: [async] matched_files:', matched_files)
-            if not matched_files:
-                print('DEBUG: [async] No matched files found')
-                supabase.table('user_requests').update({'status': 'error'}).eq('id', request_id).execute()
-                return
-            with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp_zip:
-                with zipfile.ZipFile(tmp_zip, 'w') as zipf:
-                    for idx, file_path in enumerate([os.path.join(MATCHED_FOLDER, f) for f in matched_files], 1):
-                        ext = os.path.splitext(file_path)[1]
-                        new_name = f"matched_{idx}{ext}"
-                        zipf.write(file_path, new_name)
-                zip_path = tmp_zip.name
-            print('DEBUG: [async] Zip created at', zip_path)
-            bucket_name = "matched-results"
+    with app.app_context():
+        req = supabase.table('user_requests').select('*').eq('id', request_id).single().execute().data
+        if not req:
+            print(f'DEBUG: user_request {request_id} not found')
+            return
+        email = req['email']
+        matched_files = [f for f in os.listdir(matched_folder) if f.startswith('clean_')]
+        print('DEBUG: matched_files:', matched_files)
+        if not matched_files:
+            print('DEBUG: No matched files found')
+            supabase.table('user_requests').update({'status': 'error'}).eq('id', request_id).execute()
+            return
+        # Matched video keyframes are listed with their source video and timestamp
+        video_matches = load_video_matches(matched_folder)
+        video_lines = []
+        with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp_zip:
+            with zipfile.ZipFile(tmp_zip, 'w') as zipf:
+                for idx, file_path in enumerate([os.path.join(matched_folder, f) for f in matched_files], 1):
+                    ext = os.path.splitext(file_path)[1]
+                    new_name = f"matched_{idx}{ext}"
+                    zipf.write(file_path, new_name)
+                    match = video_matches.get(os.path.basename(file_path))
+                    if match:
+                        video_lines.append(f"{new_name}: {match['video']} at {format_timestamp(match['timestamp'])}")
+                if video_lines:
+                    zipf.writestr('video_timestamps.txt', "\n".join(video_lines) + "\n")
+            zip_path = tmp_zip.name
+        print('DEBUG: Zip created at', zip_path)
+        try:
             zip_filename = f"matched_{email.replace('@', '_').replace('.', '_')}_{request_id}.zip"
-            with open(zip_path, "rb") as f:
-                upload_response = supabase.storage.from_(bucket_name).upload(
-                    zip_filename, f, {"content-type": "application/zip", "x-upsert": "true"}
-                )
-            print('DEBUG: [async] Uploaded zip, response:', upload_response)
-            public_url = supabase.storage.from_(bucket_name).get_public_url(zip_filename)
-            print('DEBUG: [async] public_url:', public_url)
+            public_url = result_storage.save(zip_path, zip_filename)
+            print('DEBUG: public_url:', public_url)
             msg = Message("Face Match Results", recipients=[email])
-            msg.body = f"\U0001F4C1 Your matched images are here:\n\n{public_url}\n\nThis link will expire in 1 hour."
+            msg.body = f"\U0001F4C1 Your matched images are here:\n\n{public_url}\n\nThis link will expire in {format_ttl(result_storage.ttl)}."
+            if video_lines:
+                msg.body += "\n\nYou also appear in these video moments:\n" + "\n".join(video_lines)
             mail.send(msg)
-            print('DEBUG: [async] Email sent')
-            now = datetime.utcnow().isoformat()
-            supabase.table('user_requests').update({
-                'zip_url': public_url,
-                'status': 'done',
-                'matched_files': matched_files,
-                'zip_uploaded_at': now
-            }).eq('id', request_id).execute()
-            print('DEBUG: [async] Updated user_request row to done')
-            os.remove(zip_path)
-            print('DEBUG: [async] Removed temp zip')
-    threading.Thread(target=worker, daemon=True).start()
+            print('DEBUG: Email sent')
+        except Exception as e:
+            print(f'DEBUG: Delivering results for {request_id} failed:', e)
+            supabase.table('user_requests').update({'status': 'error', 'error_message': str(e)}).eq('id', request_id).execute()
+            return
+        finally:
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+                print('DEBUG: Removed temp zip')
+        now = datetime.utcnow().isoformat()
+        supabase.table('user_requests').update({
+            'zip_url': public_url,
+            'status': 'done',
+            'matched_files': matched_files,
+            'zip_uploaded_at': now
+        }).eq('id', request_id).execute()
+        print('DEBUG: Updated user_request row to done')
 
 # --- Scheduled cleanup for expired zips ---
 def cleanup_expired_zips():
     """
-    Periodically checks for expired zip files in Supabase Storage (older than 1 hour) and deletes them.
+    Periodically checks for expired result zips (older than the result storage TTL) and deletes them from the result storage backend.
     Updates the corresponding user_requests row to 'expired'.
     """
     with app.app_context():
+        deleted = result_storage.cleanup_expired()
+        if deleted:
+            print(f"Deleted {deleted} expired local result zips")
         now = datetime.utcnow()
-        cutoff = now - timedelta(hours=1)
+        cutoff = now - timedelta(seconds=result_storage.ttl)
         expired = supabase.table('user_requests').select('*').neq('zip_url', None).execute().data
         for req in expired:
             uploaded_at = req.get('zip_uploaded_at')
@@ -230,10 +255,9 @@ def cleanup_expired_zips():
                 except Exception:
                     continue
                 if uploaded_time < cutoff:
-                    zip_url = req['zip_url']
-                    filename = zip_url.split('/')[-1].split('?')[0]
+                    filename = result_storage.filename_from_url(req['zip_url'])
                     try:
-                        supabase.storage.from_('matched-results').remove(filename)
+                        result_storage.delete(filename)
                         print(f"Deleted expired zip: {filename}")
                     except Exception as e:
                         print(f"Error deleting zip {filename}: {e}")
@@ -241,12 +265,12 @@ def cleanup_expired_zips():
 
 def start_cleanup_scheduler():
     """
-    Starts a background thread to periodically run cleanup_expired_zips every hour.
+    Starts a background thread to periodically run cleanup_expired_zips every hour (or every TTL, if shorter).
     """
     def loop():
         while True:
             cleanup_expired_zips()
-            time.sleep(3600)  # Run every hour
+            time.sleep(min(3600, max(result_storage.ttl, 60)))
     threading.Thread(target=loop, daemon=True).start()
 
 # Start the scheduler when app starts
@@ -277,13 +301,43 @@ def cleanup_old_gallery_images():
 # Start the gallery cleanup scheduler in background
 threading.Thread(target=cleanup_old_gallery_images, daemon=True).start()
 
-# Temporary in-memory store for uploaded frames
-uploaded_frames_store = {}
+# --- Matching job scheduler ---
+# Matching jobs are ordered by estimated cost instead of arrival order (policy: 'sjf' or 'fair').
+# Under 'fair', MATCH_EVENT_WEIGHTS (e.g. 'wedding_a:2,expo:0.5') gives events a larger or smaller share.
+# Each job matches into its own folder under REQUEST_MATCHED_FOLDER and delivers (zip, store, email) from
+# it, so MATCH_WORKERS can run several jobs at once without mixing up their results.
+match_scheduler = MatchScheduler(
+    policy=os.getenv('MATCH_SCHEDULER_POLICY', 'sjf'),
+    workers=int(os.getenv('MATCH_WORKERS', '1')),
+    event_weights=parse_event_weights(os.getenv('MATCH_EVENT_WEIGHTS'))
+)
+match_scheduler.start()
+
+# --- On-demand profiling of matching runs (armed from the admin dashboard) ---
+profiling_control = ProfilingControl()
+
+# Bounded in-memory store for uploaded frames (spills to UPLOAD_TMP_DIR under memory pressure; uploads never
+# submitted for matching expire after a TTL)
+frame_store = FrameStore(UPLOAD_TMP_DIR)
+
+def start_frame_store_sweeper():
+    """
+    Starts a background thread that evicts expired (abandoned) frame uploads every minute.
+    """
+    def loop():
+        while True:
+            time.sleep(60)
+            evicted = frame_store.sweep()
+            if evicted:
+                print(f"🧹 Evicted {evicted} expired frame uploads.")
+    threading.Thread(target=loop, daemon=True).start()
+
+start_frame_store_sweeper()
 
 @app.route('/upload_frames', methods=['POST'])
 def upload_frames():
     """
-    Receives frames (base64 images) from the frontend, stores them on disk under a request_id. Does NOT start matching yet.
+    Receives frames (base64 images) from the frontend, decodes them and keeps them in the frame store under a request_id. Does NOT start matching yet.
     """
     data = request.get_json()
     frames = data.get('frames', [])
@@ -295,17 +349,20 @@ def upload_frames():
     if not request_id:
         print("[ERROR] No request_id provided.")
         return jsonify(status='error', message='No request_id provided.'), 400
-    # Store frames on disk
-    req_dir = os.path.join(UPLOAD_TMP_DIR, request_id)
-    os.makedirs(req_dir, exist_ok=True)
-    for idx, frame in enumerate(frames):
+    # Decode frames and keep them in memory for the matcher
+    decoded_frames = []
+    for frame in frames:
         if frame.startswith('data:image'):
             header, b64data = frame.split(',', 1)
         else:
             b64data = frame
-        file_path = os.path.join(req_dir, f'frame_{idx+1:03d}.jpg')
-        with open(file_path, 'wb') as f:
-            f.write(base64.b64decode(b64data))
+        img = cv2.imdecode(np.frombuffer(base64.b64decode(b64data), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is not None:
+            decoded_frames.append(img)
+    if not decoded_frames:
+        print("[ERROR] No decodable frames received.")
+        return jsonify(status='error', message='No valid frames received.'), 400
+    frame_store.put(request_id, decoded_frames)
     print(f"[DEBUG] Frame upload complete for request_id= {request_id}")
     return jsonify(status='ok')
 
@@ -333,31 +390,41 @@ def store_email():
             'event_name': event_name
         }).execute()
         print('DEBUG: Inserted user_request row')
-        # Call process_user_request in a background thread, passing the request_id, email, and event_name
-        import threading
+        # Queue the matching job with the scheduler, passing the request_id, email, and event_name
         def run_matching():
             from match_faces import run_face_matching
-            import cv2
-            import numpy as np
-            import shutil
-            # Load frames from disk
-            req_dir = os.path.join(UPLOAD_TMP_DIR, request_id)
-            if not os.path.exists(req_dir):
-                print(f"[ERROR] No frames found on disk for request_id={request_id}")
+            # Take the uploaded frames from the frame store
+            reference_frames = frame_store.take(request_id)
+            if not reference_frames:
+                print(f"[ERROR] No frames found for request_id={request_id}")
                 supabase.table('user_requests').update({'status': 'no_frames'}).eq('id', request_id).execute()
                 return
             # Use the selected event's gallery folder
             event_gallery_folder = os.path.join(GALLERY_FOLDER, event_name)
-            match_count = run_face_matching(req_dir, event_gallery_folder)
-            # Clean up temp frames
-            shutil.rmtree(req_dir, ignore_errors=True)
-            if match_count == 0:
-                print("[ERROR] No face detected or no matches found.")
-                supabase.table('user_requests').update({'status': 'no_face'}).eq('id', request_id).execute()
-                return
-            # Continue with the rest of the pipeline (email, etc.)
-            process_pending_request_async()
-        threading.Thread(target=run_matching, daemon=True).start()
+            matched_folder = os.path.join(REQUEST_MATCHED_FOLDER, f"{secure_filename(request_id)}_{uuid.uuid4().hex[:8]}")
+            profile = profiling_control.claim(request_id, event_name)
+            match_count = 0
+            try:
+                try:
+                    match_count = run_face_matching(reference_frames, event_gallery_folder, profile=profile,
+                                                    matched_folder=matched_folder)
+                finally:
+                    profile.finish(match_count=match_count)
+                if match_count == 0:
+                    print("[ERROR] No face detected or no matches found.")
+                    supabase.table('user_requests').update({'status': 'no_face'}).eq('id', request_id).execute()
+                    return
+                # Zip, store and email this request's matches from its own folder
+                process_matched_request(request_id, matched_folder)
+            finally:
+                shutil.rmtree(matched_folder, ignore_errors=True)
+        # Pin the frames so they cannot expire while the job waits in the queue
+        if not frame_store.pin(request_id):
+            print(f"[ERROR] No frames found for request_id={request_id}")
+            supabase.table('user_requests').update({'status': 'no_frames'}).eq('id', request_id).execute()
+            return jsonify(status='ok', request_id=request_id)
+        event_gallery_folder = os.path.join(GALLERY_FOLDER, event_name)
+        match_scheduler.submit(request_id, event_name, run_matching, cost=estimate_event_cost(event_gallery_folder))
     except Exception as e:
         print('DEBUG: Exception occurred:', e)
         return jsonify(status='error', message=str(e))
@@ -369,8 +436,9 @@ def status():
     """
     Returns the status and zip_url for a given user request.
     Accepts request_id via GET or POST.
+    While the matching job is waiting in the scheduler, also returns its queue position and estimated wait.
     Returns:
-        JSON: {status: ..., zip_url: ..., error_message: ...} or error message.
+        JSON: {status: ..., zip_url: ..., error_message: ..., queue_position: ..., estimated_wait_seconds: ...} or error message.
     """
     if request.method == 'POST':
         request_id = request.get_json().get('request_id')
@@ -381,12 +449,80 @@ def status():
     row = supabase.table('user_requests').select('*').eq('id', request_id).single().execute().data
     if not row:
         return jsonify(status='error', message='Request not found')
+    queue = match_scheduler.queue_info(request_id) or {}
     return jsonify(
         status=row['status'],
         zip_url=row.get('zip_url'),
-        error_message=row.get('error_message', '')
+        error_message=row.get('error_message', ''),
+        queue_position=queue.get('queue_position'),
+        estimated_wait_seconds=queue.get('estimated_wait_seconds')
     )
 
+@app.route('/supersecretadmin/frame_store_stats')
+def frame_store_stats():
+    """
+    (Admin) Returns frame store usage and hit, spill and eviction counts.
+    Returns:
+        JSON: Frame store stats.
+    """
+    if not is_admin_logged_in():
+        return jsonify(status='error', message='Not authorized'), 403
+    return jsonify(status='ok', stats=frame_store.stats())
+
+@app.route('/supersecretadmin/scheduler_metrics')
+def scheduler_metrics():
+    """
+    (Admin) Returns matching scheduler metrics: queue depth and p50/p95 completion times per policy.
+    Returns:
+        JSON: Scheduler metrics.
+    """
+    if not is_admin_logged_in():
+        return jsonify(status='error', message='Not authorized'), 403
+    return jsonify(status='ok', metrics=match_scheduler.metrics())
+
+@app.route('/supersecretadmin/scheduler_config', methods=['GET', 'POST'])
+def scheduler_config():
+    """
+    (Admin) Shows or changes the matching scheduler policy and per-event fair-share weights.
+    POST JSON: {policy: 'sjf' | 'fair' (optional), event_weights: {event_name: weight, ...} (optional)}
+    Returns:
+        JSON: {status: 'ok', policy: ..., event_weights: {...}} or error message.
+    """
+    if not is_admin_logged_in():
+        return jsonify(status='error', message='Not authorized'), 403
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        policy = data.get('policy')
+        weights = data.get('event_weights') or {}
+        if policy and policy not in POLICIES:
+            return jsonify(status='error', message='Unknown scheduling policy.'), 400
+        try:
+            weights = {secure_filename(e): float(w) for e, w in weights.items()}
+        except (AttributeError, TypeError, ValueError):
+            return jsonify(status='error', message='event_weights must map event names to numbers.'), 400
+        if policy:
+            match_scheduler.set_policy(policy)
+        for event_name, weight in weights.items():
+            match_scheduler.set_event_weight(event_name, weight)
+    return jsonify(status='ok', policy=match_scheduler.policy, event_weights=match_scheduler.event_weights())
+
+@app.route('/results/<path:filename>')
+def download_result(filename):
+    """
+    Serves a result zip from local result storage if the signed URL is valid and not expired.
+    Returns:
+        Response: The zip file as an attachment, or 403/404 error.
+    """
+    if not isinstance(result_storage, LocalResultStorage):
+        return jsonify(status='error', message='Not found'), 404
+    # Stored names are already safe; anything else cannot carry a valid signature
+    if filename != result_storage.safe_filename(filename) or \
+            not result_storage.verify(filename, request.args.get('expires'), request.args.get('sig')):
+        return jsonify(status='error', message='Link is invalid or has expired.'), 403
+    if not os.path.isfile(result_storage.path_for(filename)):
+        return jsonify(status='error', message='Result not found'), 404
+    return send_from_directory(os.path.abspath(result_storage.folder), filename, as_attachment=True)
+
 # Optionally, you can remove or disable the /send_email endpoint, or keep it for admin/manual use only.
 
 
@@ -475,11 +611,89 @@ def list_user_logs():
     logs = supabase.table('user_requests').select('id,email,created_at,status,matched_files,zip_url').order('created_at', desc=True).limit(100).execute().data
     return jsonify(logs)
 
+def ingest_event_uploads(event_gallery_folder, videos):
+    """
+    Background task after a gallery upload: extracts keyframes from uploaded videos, then updates the event's gallery index.
+    Per-image detect/encode work happens here, so when profiling is armed for the event this run is profiled too.
+    Args:
+        event_gallery_folder (str): Event gallery folder.
+        videos (list): (video_path, original_name) tuples to ingest; the video files are removed afterwards.
+    """
+    event_name = os.path.basename(os.path.normpath(event_gallery_folder))
+    profile = profiling_control.claim(f"ingest-{uuid.uuid4().hex[:8]}", event_name)
+    face_count = 0
+    try:
+        for video_path, original_name in videos:
+            try:
+                with profile.stage(f"video/{original_name}", 'keyframes'):
+                    ingest_video(video_path, event_gallery_folder, original_name)
+            except Exception as e:
+                print(f"❌ Video ingest error for {original_name}:", e)
+        face_count = update_gallery_index(event_gallery_folder, profile=profile).face_count
+    finally:
+        profile.finish(kind='gallery ingest', videos=len(videos), indexed_faces=face_count)
+
+def index_existing_galleries():
+    """
+    Background task at startup: brings every event's gallery index in line with its folder (galleries
+    uploaded before indexing existed, or changed while the app was down). Matching never indexes itself.
+    """
+    if not os.path.isdir(GALLERY_FOLDER):
+        return
+    for event_name in sorted(os.listdir(GALLERY_FOLDER)):
+        event_gallery_folder = os.path.join(GALLERY_FOLDER, event_name)
+        if os.path.isdir(event_gallery_folder) and not event_name.startswith('.'):
+            try:
+                update_gallery_index(event_gallery_folder)
+            except Exception as e:
+                print(f"❌ Indexing error for event {event_name}:", e)
+
+threading.Thread(target=index_existing_galleries, daemon=True).start()
+
+@app.route('/supersecretadmin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """
+    (Admin) Arms or disarms profiling of upcoming matching runs, and lists saved profiles.
+    POST JSON: {runs: N (0 disarms), event_name: optional, mode: 'sampling' | 'deterministic'}
+    Returns:
+        JSON: {status: 'ok', control: {...}, profiles: [...]} or error message.
+    """
+    if not is_admin_logged_in():
+        return jsonify(status='error', message='Not authorized'), 403
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        mode = data.get('mode', 'sampling')
+        if mode not in MODES:
+            return jsonify(status='error', message='Unknown profiling mode.'), 400
+        try:
+            runs = int(data.get('runs', 0))
+        except (TypeError, ValueError):
+            return jsonify(status='error', message='runs must be a number.'), 400
+        event_name = data.get('event_name')
+        profiling_control.arm(runs, secure_filename(event_name) if event_name else None, mode)
+    return jsonify(status='ok', control=profiling_control.status(), profiles=list_profiles())
+
+@app.route('/supersecretadmin/profiles/<profile_id>/<filename>')
+def admin_download_profile(profile_id, filename):
+    """
+    (Admin) Downloads a file (profile, report, stacks) of a saved matching profile.
+    Returns:
+        Response: The file as an attachment, or error message.
+    """
+    if not is_admin_logged_in():
+        return jsonify(status='error', message='Not authorized'), 403
+    profile_id = secure_filename(profile_id)
+    if filename not in PROFILE_FILES or not os.path.isfile(os.path.join(PROFILES_FOLDER, profile_id, filename)):
+        return jsonify(status='error', message='File not found'), 404
+    return send_from_directory(os.path.abspath(os.path.join(PROFILES_FOLDER, profile_id)), filename, as_attachment=True)
+
 @app.route('/admin/upload_gallery', methods=['POST'])
 def admin_upload_gallery():
     """
     (Admin) Handles file uploads to the gallery.
     Supports zip file upload or multiple file uploads, organized by event name.
+    Video files are sampled into keyframes, then new photos and keyframes are encoded and clustered
+    into the event's gallery index in the background.
     Returns:
         JSON: {status: 'ok'} on success, or error message.
     """
@@ -502,20 +716,30 @@ def admin_upload_gallery():
             with zipfile.ZipFile(tmp_zip_path, 'r') as zip_ref:
                 zip_ref.extractall(event_gallery_folder)
             os.remove(tmp_zip_path)
+            videos = [(os.path.join(event_gallery_folder, f), f) for f in os.listdir(event_gallery_folder) if is_video_file(f)]
+            threading.Thread(target=ingest_event_uploads, args=(event_gallery_folder, videos), daemon=True).start()
             return jsonify(status='ok')
 
         # Check for folder upload (multiple files)
         files = request.files.getlist('gallery_files')
         ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
         if files:
+            videos = []
             for f in files:
                 filename = os.path.basename(f.filename)
                 ext = os.path.splitext(filename)[1].lower()
+                if is_video_file(filename):
+                    # Videos are staged outside the gallery; only their keyframes end up in it
+                    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp_video:
+                        f.save(tmp_video)
+                        videos.append((tmp_video.name, secure_filename(filename)))
+                    continue
                 if ext not in ALLOWED_EXTENSIONS:
                     continue  # Skip non-image files
                 unique_name = f"gallery_{int(time.time())}_{uuid.uuid4().hex[:8]}{ext}"
                 dest_path = os.path.join(event_gallery_folder, unique_name)
                 f.save(dest_path)
+            threading.Thread(target=ingest_event_uploads, args=(event_gallery_folder, videos), daemon=True).start()
             return jsonify(status='ok')
 
         return jsonify(status='error', message='No files uploaded.')
@@ -601,6 +825,7 @@ print(result)
 def capture():
     """
     Triggers the face matching process.
+    Results are delivered for the request_id in the JSON body, if one is given.
     Returns:
         JSON: {status: 'ok'} on success, or error message.
     """
@@ -620,8 +845,9 @@ def capture():
     if not matched_files:
         return jsonify(status='no_face')
 
-    # Trigger async post-matching process
-    process_pending_request_async()
+    request_id = (request.get_json(silent=True) or {}).get('request_id')
+    if request_id:
+        process_matched_request(request_id)
 
     return jsonify(status='ok')
 
@@ -0,0 +1,118 @@
+"""
+Batched face descriptor computation.
+Faces are detected and aligned per image (5-point landmarks, 150x150 chips, exactly as
+face_recognition.face_encodings does), but the ResNet descriptor network runs on chips collected
+from many images at once through dlib's batch compute_face_descriptor API.
+"""
+import os
+import sys
+import dlib
+import face_recognition
+import numpy as np
+# face_recognition.api exposes its loaded dlib models only as undocumented module attributes; a change there
+# (or in how face_encodings aligns faces) is caught by tests/test_face_encoding.py
+from face_recognition.api import pose_predictor_5_point, face_encoder
+from profiling import NULL_PROFILE
+
+FACE_BATCH_SIZE = int(os.getenv('FACE_BATCH_SIZE', '64'))
+# Same chip geometry as dlib's single-image compute_face_descriptor
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+# Max distance allowed between batched and per-image encodings of the same face
+ENCODING_TOLERANCE = 1e-4
+
+def css_to_rect(location):
+    """
+    Converts a (top, right, bottom, left) face location to a dlib.rectangle.
+    """
+    top, right, bottom, left = location
+    return dlib.rectangle(left, top, right, bottom)
+
+class BatchFaceEncoder:
+    """
+    Collects aligned face chips from many images and computes their 128-d descriptors in batches.
+    Call add() per image, then results() once all images are added. At most batch_size chips are held in memory.
+    """
+    def __init__(self, batch_size=FACE_BATCH_SIZE, num_jitters=1, profile=NULL_PROFILE):
+        self.batch_size = max(int(batch_size), 1)
+        self.num_jitters = num_jitters
+        self.profile = profile
+        self._chips = []
+        self._owners = []   # (key, face position) for each pending chip
+        self._results = {}  # key -> list of encodings, in face location order
+        self.batches = 0
+
+    def add(self, key, img_rgb, face_locations):
+        """
+        Aligns the faces at face_locations in an RGB image and queues them for encoding under key.
+        """
+        self._results.setdefault(key, [None] * len(face_locations))
+        for pos, location in enumerate(face_locations):
+            with self.profile.stage(str(key), 'align'):
+                shape = pose_predictor_5_point(img_rgb, css_to_rect(location))
+                self._chips.append(dlib.get_face_chip(img_rgb, shape, size=CHIP_SIZE, padding=CHIP_PADDING))
+            self._owners.append((key, pos))
+            if len(self._chips) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Runs the descriptor network on all pending chips.
+        """
+        if not self._chips:
+            return
+        with self.profile.stage('(descriptor batches)', 'encode'):
+            descriptors = face_encoder.compute_face_descriptor(self._chips, self.num_jitters)
+        for (key, pos), descriptor in zip(self._owners, descriptors):
+            self._results[key][pos] = np.array(descriptor)
+        self._chips = []
+        self._owners = []
+        self.batches += 1
+
+    def results(self):
+        """
+        Flushes remaining chips and returns the encodings.
+        Returns:
+            dict: {key: list of 128-d encodings, one per face location passed to add()}
+        """
+        self.flush()
+        return self._results
+
+def encode_frames(frames_rgb, batch_size=FACE_BATCH_SIZE, profile=NULL_PROFILE):
+    """
+    Detects faces in each (name, RGB frame) pair and encodes all of them in batches.
+    Returns:
+        list: Encodings of every face found, in frame order.
+    """
+    encoder = BatchFaceEncoder(batch_size, profile=profile)
+    for name, rgb in frames_rgb:
+        with profile.stage(name, 'detect'):
+            face_locations = face_recognition.face_locations(rgb)
+        profile.note(name, width=rgb.shape[1], height=rgb.shape[0], faces=len(face_locations))
+        encoder.add(name, rgb, face_locations)
+    results = encoder.results()
+    return [enc for name, _ in frames_rgb for enc in results.get(name, [])]
+
+def compare_with_per_image(frames_rgb, batch_size=8):
+    """
+    Encodes frames in batches and with face_recognition's per-image path.
+    Returns:
+        tuple: (number of faces per path as (batched, per_image), max distance between corresponding encodings)
+    """
+    batched = encode_frames(frames_rgb, batch_size=batch_size)
+    single = [enc for _, img in frames_rgb
+              for enc in face_recognition.face_encodings(img, face_recognition.face_locations(img))]
+    diffs = [float(np.linalg.norm(a - b)) for a, b in zip(batched, single)]
+    return (len(batched), len(single)), max(diffs, default=0.0)
+
+# --- Standalone check: batched vs per-image encodings ---
+if __name__ == "__main__":
+    import cv2
+    images = [(p, cv2.imread(p)) for p in sys.argv[1:]]
+    images = [(p, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)) for p, img in images if img is not None]
+    if not images:
+        print("Usage: python face_encoding.py image1.jpg [image2.jpg ...]")
+        sys.exit(1)
+    (n_batched, n_single), max_diff = compare_with_per_image(images)
+    print(f"{n_batched} faces; max distance between batched and per-image encodings: {max_diff:.6f}")
+    sys.exit(0 if n_batched == n_single and max_diff < ENCODING_TOLERANCE else 1)
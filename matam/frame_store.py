@@ -0,0 +1,196 @@
+"""
+Bounded in-memory store for uploaded reference frames.
+Decoded frames are kept in memory per request_id under a global byte budget and handed straight to the
+matcher. Least recently used entries spill to disk only when the budget is exceeded (written outside the
+lock, so other requests are not blocked behind the disk), and entries (in memory or spilled) expire after
+a TTL so abandoned uploads do not pile up. Once a request is submitted for matching, its entry is pinned:
+it no longer expires, however long the job waits in the queue, until the job takes it.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+
+FRAME_STORE_MAX_BYTES = int(os.getenv('FRAME_STORE_MAX_BYTES', str(512 * 1024 * 1024)))
+FRAME_STORE_TTL_SECONDS = int(os.getenv('FRAME_STORE_TTL_SECONDS', '1800'))
+
+class FrameStore:
+    """
+    Thread-safe request_id -> list of decoded frames store with byte budget, TTL and disk spill.
+    """
+    def __init__(self, spill_dir, max_bytes=FRAME_STORE_MAX_BYTES, ttl_seconds=FRAME_STORE_TTL_SECONDS):
+        self.spill_dir = spill_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # request_id -> (frames, nbytes, created_at), least recently used first
+        self._spilling = {}           # request_id -> (frames, nbytes, created_at) while being written to disk
+        self._spilled = {}            # request_id -> (path, nbytes, created_at)
+        self._pinned = set()          # request_ids submitted for matching; exempt from the TTL
+        self._bytes = 0
+        self._counts = {'puts': 0, 'hits': 0, 'spill_hits': 0, 'misses': 0, 'spills': 0, 'evictions': 0}
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, request_id, frames):
+        """
+        Stores the frames for a request, replacing any earlier upload, spilling older entries if over budget.
+        Args:
+            request_id (str): The user request the frames belong to.
+            frames (list): Decoded BGR frames (numpy arrays).
+        """
+        nbytes = sum(f.nbytes for f in frames)
+        victims = []
+        with self._lock:
+            self._discard_locked(request_id)
+            self._counts['puts'] += 1
+            self._memory[request_id] = (frames, nbytes, time.time())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._memory:
+                victim_id, entry = self._memory.popitem(last=False)
+                self._bytes -= entry[1]
+                self._spilling[victim_id] = entry
+                victims.append((victim_id, entry))
+        for victim_id, entry in victims:
+            self._spill(victim_id, entry)
+
+    def pin(self, request_id):
+        """
+        Exempts a request's frames from the TTL, e.g. once its matching job is queued. They can still spill.
+        Returns:
+            bool: True if frames are stored (and not already expired) for the request.
+        """
+        with self._lock:
+            entry = (self._memory.get(request_id) or self._spilling.get(request_id)
+                     or self._spilled.get(request_id))
+            if entry is None or self._expired(entry[2], pinned=False):
+                return False
+            self._pinned.add(request_id)
+            return True
+
+    def take(self, request_id):
+        """
+        Removes and returns the frames for a request, from memory or from disk if they were spilled.
+        Returns:
+            list or None: The frames, or None if unknown or expired.
+        """
+        with self._lock:
+            pinned = request_id in self._pinned
+            self._pinned.discard(request_id)
+            entry = self._memory.pop(request_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+            else:
+                # Frames still being spilled are in memory; the spill then finds them gone and drops its file
+                entry = self._spilling.pop(request_id, None)
+            if entry is not None:
+                frames, nbytes, created_at = entry
+                if not self._expired(created_at, pinned):
+                    self._counts['hits'] += 1
+                    return frames
+                self._counts['evictions'] += 1
+                self._counts['misses'] += 1
+                return None
+            spilled = self._spilled.pop(request_id, None)
+            if spilled is None:
+                self._counts['misses'] += 1
+                return None
+        path, nbytes, created_at = spilled
+        try:
+            if self._expired(created_at, pinned):
+                with self._lock:
+                    self._counts['evictions'] += 1
+                    self._counts['misses'] += 1
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                frames = [data[f"arr_{i}"] for i in range(len(data.files))]
+            with self._lock:
+                self._counts['spill_hits'] += 1
+            return frames
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def discard(self, request_id):
+        """
+        Drops any frames stored for a request.
+        """
+        with self._lock:
+            self._discard_locked(request_id)
+
+    def sweep(self):
+        """
+        Evicts unpinned entries older than the TTL, in memory and on disk.
+        Returns:
+            int: Number of entries evicted.
+        """
+        with self._lock:
+            expired = [rid for rid, (_, _, created) in self._memory.items()
+                       if self._expired(created, rid in self._pinned)]
+            expired += [rid for rid, (_, _, created) in self._spilling.items()
+                        if self._expired(created, rid in self._pinned)]
+            expired += [rid for rid, (_, _, created) in self._spilled.items()
+                        if self._expired(created, rid in self._pinned)]
+            for rid in expired:
+                self._discard_locked(rid)
+            self._counts['evictions'] += len(expired)
+        return len(expired)
+
+    def stats(self):
+        """
+        Returns entry counts, memory use and hit/spill/eviction counters.
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            stats.update({
+                'memory_entries': len(self._memory),
+                'spilling_entries': len(self._spilling),
+                'spilled_entries': len(self._spilled),
+                'pinned_entries': len(self._pinned),
+                'memory_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+            })
+            return stats
+
+    def _expired(self, created_at, pinned):
+        return not pinned and time.time() - created_at > self.ttl_seconds
+
+    def _spill(self, request_id, entry):
+        """
+        Writes an entry taken off the memory list to disk without holding the lock, then records it as spilled
+        unless it was taken, replaced or discarded meanwhile. If the write fails it goes back to memory.
+        """
+        frames, nbytes, created_at = entry
+        path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.npz")
+        try:
+            np.savez(path, *frames)
+        except OSError as e:
+            print(f"⚠️ Could not spill frames for {request_id}: {e}")
+            with self._lock:
+                if self._spilling.get(request_id) is entry:
+                    del self._spilling[request_id]
+                    self._memory[request_id] = entry
+                    self._memory.move_to_end(request_id, last=False)
+                    self._bytes += nbytes
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with self._lock:
+            if self._spilling.get(request_id) is entry:
+                del self._spilling[request_id]
+                self._spilled[request_id] = (path, nbytes, created_at)
+                self._counts['spills'] += 1
+                return
+        os.remove(path)
+
+    def _discard_locked(self, request_id):
+        self._pinned.discard(request_id)
+        entry = self._memory.pop(request_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        self._spilling.pop(request_id, None)
+        spilled = self._spilled.pop(request_id, None)
+        if spilled is not None and os.path.exists(spilled[0]):
+            os.remove(spilled[0])
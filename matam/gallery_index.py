@@ -0,0 +1,389 @@
+"""
+Per-event index of gallery face encodings, grouped into identity clusters.
+Gallery images are encoded once (and incrementally as new photos arrive) instead of on every request,
+and faces are clustered into identities with dlib's Chinese Whispers. Queries are compared against
+cluster representatives first and only the clusters that can contain a match are expanded.
+Very large galleries can instead be searched through an approximate IVF index (see ann_index).
+"""
+import os
+import threading
+import cv2
+import dlib
+import face_recognition
+import numpy as np
+from profiling import NULL_PROFILE
+from face_encoding import BatchFaceEncoder
+from ann_index import ANN_ENABLED, ANN_MIN_FACES, ANN_NPROBE, build_ann_index
+
+GALLERY_INDEX_FOLDER = 'gallery_index'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+ENCODING_SIZE = 128
+
+# Chinese Whispers edge threshold; dlib's face clustering example uses 0.5
+CLUSTER_THRESHOLD = 0.5
+# Representatives are added per cluster until every member is within this distance of one
+REPRESENTATIVE_RADIUS = 0.3
+MAX_REPRESENTATIVES = 5
+
+def pairwise_distances(a, b):
+    """
+    Euclidean distances between every row of a (n, d) and every row of b (m, d).
+    Returns:
+        np.ndarray: (n, m) distance matrix.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    sq = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * a @ b.T
+    return np.sqrt(np.maximum(sq, 0.0))
+
+def detect_faces(path, profile=NULL_PROFILE):
+    """
+    Loads a gallery image and detects its faces. Encoding happens later, in batches.
+    Returns:
+        tuple: (RGB image or None if unreadable, list of (top, right, bottom, left) locations)
+    """
+    name = os.path.basename(path)
+    with profile.stage(name, 'load'):
+        img_bgr = cv2.imread(path)
+    if img_bgr is None:
+        return None, []
+    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    with profile.stage(name, 'detect'):
+        face_locations = face_recognition.face_locations(img_rgb)
+    profile.note(name, width=img_bgr.shape[1], height=img_bgr.shape[0], faces=len(face_locations),
+                 bytes=os.path.getsize(path))
+    return img_rgb, face_locations
+
+def list_gallery_images(gallery_folder):
+    """
+    Returns:
+        dict: {filename: mtime} for every image currently in the gallery folder.
+    """
+    current = {}
+    if os.path.isdir(gallery_folder):
+        for fname in os.listdir(gallery_folder):
+            fpath = os.path.join(gallery_folder, fname)
+            if fname.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(fpath):
+                current[fname] = os.path.getmtime(fpath)
+    return current
+
+def scan_gallery_images(gallery_folder, filenames, ref_encodings, threshold, profile=NULL_PROFILE):
+    """
+    Exact search of images the index does not cover yet: detects and encodes them now and compares
+    every face against the reference encodings. Nothing is stored; the background ingest indexes them.
+    Returns:
+        list: (filename, (top, right, bottom, left), distance) for each matching face, like GalleryIndex.match().
+    """
+    encoder = BatchFaceEncoder(profile=profile)
+    locations_by_file = {}
+    for fname in filenames:
+        img_rgb, locations = detect_faces(os.path.join(gallery_folder, fname), profile)
+        if locations:
+            encoder.add(fname, img_rgb, locations)
+            locations_by_file[fname] = locations
+    encodings_by_file = encoder.results()
+    hits = []
+    for fname, locations in locations_by_file.items():
+        with profile.stage(fname, 'match'):
+            dists = pairwise_distances(encodings_by_file[fname], ref_encodings).min(axis=1)
+        hits.extend((fname, tuple(int(v) for v in location), float(d))
+                    for location, d in zip(locations, dists) if d < threshold)
+    return hits
+
+def chinese_whispers(encodings, threshold=CLUSTER_THRESHOLD):
+    """
+    Clusters encodings into identities with dlib's Chinese Whispers.
+    Returns:
+        np.ndarray: Cluster label (0..k-1) for each encoding.
+    """
+    if len(encodings) == 0:
+        return np.zeros(0, dtype=np.int64)
+    descriptors = [dlib.vector(list(map(float, e))) for e in encodings]
+    return np.asarray(dlib.chinese_whispers_clustering(descriptors, threshold), dtype=np.int64)
+
+def select_representatives(members):
+    """
+    Picks representative vectors for one cluster: its centroid plus the farthest members,
+    until every member is within REPRESENTATIVE_RADIUS of a representative (or MAX_REPRESENTATIVES is reached).
+    Returns:
+        tuple: ((k, 128) representatives, radius) where radius bounds every member's distance to its nearest representative.
+    """
+    reps = [members.mean(axis=0)]
+    nearest = pairwise_distances(members, reps[:1])[:, 0]
+    while nearest.max() > REPRESENTATIVE_RADIUS and len(reps) < MAX_REPRESENTATIVES:
+        far = int(nearest.argmax())
+        reps.append(members[far])
+        nearest = np.minimum(nearest, pairwise_distances(members, members[far:far + 1])[:, 0])
+    return np.vstack(reps), float(nearest.max())
+
+class GalleryIndex:
+    """
+    Face encodings and identity clusters for one event gallery, persisted to GALLERY_INDEX_FOLDER/<event>.npz.
+    Use update() to bring it in line with the gallery folder (background ingest only) and match() to query it.
+    `lock` guards the arrays: match() runs under it, while update() encodes new images without it and only
+    holds it to swap the results in, so matching is never blocked behind indexing. Updates are serialized
+    by `update_lock`.
+    """
+    def __init__(self, event_name, index_folder=GALLERY_INDEX_FOLDER):
+        self.event_name = event_name
+        self.path = os.path.join(index_folder, f"{event_name}.npz")
+        self.lock = threading.RLock()
+        self.update_lock = threading.RLock()
+        self.file_mtimes = {}  # Every indexed image, including ones without faces
+        self.face_files = np.zeros(0, dtype=str)
+        self.locations = np.zeros((0, 4), dtype=np.int64)
+        self.encodings = np.zeros((0, ENCODING_SIZE))
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.rep_vectors = np.zeros((0, ENCODING_SIZE))
+        self.rep_labels = np.zeros(0, dtype=np.int64)
+        self.cluster_radius = {}
+        self.next_label = 0
+        self.ann = None  # IVFIndex over the rows of encodings, built in the background by refresh_ann(); not persisted
+
+    @property
+    def face_count(self):
+        return len(self.encodings)
+
+    @property
+    def cluster_count(self):
+        return len(self.cluster_radius)
+
+    def load(self):
+        """
+        Loads the index from disk if it exists.
+        """
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            self.file_mtimes = dict(zip(data['files'].tolist(), data['mtimes'].tolist()))
+            self.face_files = data['face_files']
+            self.locations = data['locations']
+            self.encodings = data['encodings']
+            self.labels = data['labels']
+            self.rep_vectors = data['rep_vectors']
+            self.rep_labels = data['rep_labels']
+            self.cluster_radius = dict(zip(data['cluster_ids'].tolist(), data['cluster_radius'].tolist()))
+            self.next_label = int(data['next_label'])
+
+    def save(self):
+        """
+        Writes the index to disk atomically. Only the snapshot is taken under `lock`, not the write.
+        """
+        with self.lock:
+            # Arrays are replaced, never modified in place, so references are a consistent snapshot
+            arrays = dict(
+                files=np.array(list(self.file_mtimes.keys()), dtype=str),
+                mtimes=np.array(list(self.file_mtimes.values()), dtype=np.float64),
+                face_files=self.face_files,
+                locations=self.locations,
+                encodings=self.encodings,
+                labels=self.labels,
+                rep_vectors=self.rep_vectors,
+                rep_labels=self.rep_labels,
+                cluster_ids=np.array(list(self.cluster_radius.keys()), dtype=np.int64),
+                cluster_radius=np.array(list(self.cluster_radius.values()), dtype=np.float64),
+                next_label=np.int64(self.next_label),
+            )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def update(self, gallery_folder, profile=NULL_PROFILE):
+        """
+        Brings the index in line with the gallery folder: encodes new or changed images,
+        drops faces of removed images, assigns new faces to clusters and refreshes touched clusters.
+        Detection and encoding run without holding `lock`; matches meanwhile see the previous snapshot.
+        Returns:
+            bool: True if the index changed.
+        """
+        with self.update_lock:
+            return self._update(gallery_folder, profile)
+
+    def pending_changes(self, current):
+        """
+        Compares the index with the gallery's current images (see list_gallery_images).
+        Returns:
+            tuple: (stale, added) where stale is the set of indexed images that were removed or changed
+            and added the list of images that are new or changed, i.e. not covered by the index yet.
+        """
+        with self.lock:
+            stale = {f for f, mtime in self.file_mtimes.items() if current.get(f) != mtime}
+            added = [f for f, mtime in current.items() if self.file_mtimes.get(f) != mtime]
+        return stale, added
+
+    def _update(self, gallery_folder, profile):
+        current = list_gallery_images(gallery_folder)
+        stale, added = self.pending_changes(current)
+        if not stale and not added:
+            return False
+        # Detect per image, then compute descriptors for faces from many images in batches
+        encoder = BatchFaceEncoder(profile=profile)
+        locations_by_file = {}
+        for fname in added:
+            img_rgb, locations = detect_faces(os.path.join(gallery_folder, fname), profile)
+            if locations:
+                encoder.add(fname, img_rgb, locations)
+                locations_by_file[fname] = locations
+        encodings_by_file = encoder.results()
+        new_files, new_locations, new_encodings = [], [], []
+        for fname, locations in locations_by_file.items():
+            new_files.extend([fname] * len(locations))
+            new_locations.extend(locations)
+            new_encodings.extend(encodings_by_file[fname])
+        with self.lock:
+            self._apply_update(current, stale, added, new_files, new_locations, new_encodings)
+        print(f"🗂️ Indexed event '{self.event_name}': +{len(added)} / -{len(stale)} images, "
+              f"{self.face_count} faces in {self.cluster_count} clusters.")
+        return True
+
+    def _apply_update(self, current, stale, added, new_files, new_locations, new_encodings):
+        """
+        Swaps freshly encoded faces in and removed images' faces out. Caller holds `lock`.
+        """
+        touched = set()
+        if stale:
+            keep = ~np.isin(self.face_files, list(stale))
+            touched.update(self.labels[~keep].tolist())
+            self.face_files = self.face_files[keep]
+            self.locations = self.locations[keep]
+            self.encodings = self.encodings[keep]
+            self.labels = self.labels[keep]
+            if self.ann is not None:
+                self.ann.keep(keep)
+            for f in stale:
+                self.file_mtimes.pop(f, None)
+        for fname in added:
+            self.file_mtimes[fname] = current[fname]
+        if new_encodings:
+            new_encodings = np.asarray(new_encodings, dtype=np.float64)
+            new_labels = self._assign_clusters(new_encodings)
+            touched.update(new_labels.tolist())
+            self.face_files = np.concatenate([self.face_files, np.array(new_files, dtype=str)])
+            self.locations = np.vstack([self.locations, np.asarray(new_locations, dtype=np.int64)])
+            self.encodings = np.vstack([self.encodings, new_encodings])
+            self.labels = np.concatenate([self.labels, new_labels])
+            if self.ann is not None:
+                self.ann.add(new_encodings)
+        self._refresh_representatives(touched)
+
+    def _assign_clusters(self, new_encodings):
+        """
+        Assigns new faces to the nearest existing cluster when close enough to one of its representatives,
+        and clusters the rest among themselves into new identities.
+        """
+        labels = np.full(len(new_encodings), -1, dtype=np.int64)
+        if len(self.rep_vectors):
+            dists = pairwise_distances(new_encodings, self.rep_vectors)
+            nearest = dists.argmin(axis=1)
+            close = dists[np.arange(len(new_encodings)), nearest] < CLUSTER_THRESHOLD
+            labels[close] = self.rep_labels[nearest[close]]
+        unassigned = np.nonzero(labels < 0)[0]
+        if len(unassigned):
+            local = chinese_whispers(new_encodings[unassigned])
+            labels[unassigned] = local + self.next_label
+            self.next_label += int(local.max()) + 1
+        return labels
+
+    def _refresh_representatives(self, touched):
+        """
+        Recomputes representatives and radius for the given cluster labels.
+        """
+        keep = ~np.isin(self.rep_labels, list(touched))
+        rep_vectors = [self.rep_vectors[keep]]
+        rep_labels = [self.rep_labels[keep]]
+        for label in touched:
+            members = self.encodings[self.labels == label]
+            if not len(members):
+                self.cluster_radius.pop(label, None)
+                continue
+            reps, radius = select_representatives(members)
+            rep_vectors.append(reps)
+            rep_labels.append(np.full(len(reps), label, dtype=np.int64))
+            self.cluster_radius[label] = radius
+        self.rep_vectors = np.vstack(rep_vectors)
+        self.rep_labels = np.concatenate(rep_labels)
+
+    def refresh_ann(self):
+        """
+        Builds the IVF index when the gallery is large enough and has none, or retrains it once the gallery
+        has grown to more than twice the size its centroids were trained on. Training runs without `lock`
+        (matches keep using the previous index, or exact search); call it under `update_lock` so the
+        encodings cannot change meanwhile. Between retrains, update() keeps the index in step incrementally.
+        """
+        with self.lock:
+            encodings, ann = self.encodings, self.ann
+            if not ANN_ENABLED or len(encodings) < ANN_MIN_FACES:
+                self.ann = None  # Small enough for exact search
+                return
+        if ann is not None and len(encodings) <= 2 * ann.trained_size:
+            return
+        new_ann = build_ann_index(encodings)
+        with self.lock:
+            self.ann = new_ann
+
+    def match(self, ref_encodings, threshold, nprobe=ANN_NPROBE):
+        """
+        Finds every gallery face within threshold of any reference encoding.
+        Clusters are pruned with the bound  min_rep_distance - radius >= threshold,  which by the triangle
+        inequality guarantees none of their members can match, so the result equals a full comparison.
+        If an ANN index is enabled for this gallery size, it is searched instead: faces it returns are
+        within threshold, but faces in unprobed lists may be missed.
+        Returns:
+            list: (filename, (top, right, bottom, left), distance) for each matching face.
+        """
+        if not self.face_count or not len(ref_encodings):
+            return []
+        ann = self.ann
+        if ann is not None:
+            hits, dists = ann.range_search(ref_encodings, threshold, self.encodings, nprobe)
+            print(f"🔎 Searched {min(nprobe, ann.nlist)} of {ann.nlist} IVF lists per reference over "
+                  f"{self.face_count} gallery faces: {len(hits)} matches.")
+            return [(str(self.face_files[i]), tuple(int(v) for v in self.locations[i]), float(d))
+                    for i, d in zip(hits, dists)]
+        rep_dist = pairwise_distances(self.rep_vectors, ref_encodings).min(axis=1)
+        cluster_ids = np.array(list(self.cluster_radius.keys()), dtype=np.int64)
+        lower_bound = np.full(self.next_label, np.inf)
+        np.minimum.at(lower_bound, self.rep_labels, rep_dist)
+        lower_bound[cluster_ids] -= np.array(list(self.cluster_radius.values()))
+        candidates = cluster_ids[lower_bound[cluster_ids] < threshold]
+        idx = np.nonzero(np.isin(self.labels, candidates))[0]
+        if not len(idx):
+            return []
+        dists = pairwise_distances(self.encodings[idx], ref_encodings).min(axis=1)
+        hits = idx[dists < threshold]
+        print(f"🔎 Compared {len(idx)} of {self.face_count} gallery faces "
+              f"({len(candidates)} of {self.cluster_count} clusters expanded).")
+        return [(str(self.face_files[i]), tuple(int(v) for v in self.locations[i]), float(d))
+                for i, d in zip(hits, dists[dists < threshold])]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_gallery_index(gallery_folder):
+    """
+    Returns the (cached) index for an event gallery folder, loading it from disk on first use.
+    """
+    event_name = os.path.basename(os.path.normpath(gallery_folder))
+    with _indexes_lock:
+        index = _indexes.get(event_name)
+        if index is None:
+            index = GalleryIndex(event_name)
+            index.load()
+            _indexes[event_name] = index
+    return index
+
+def update_gallery_index(gallery_folder, profile=NULL_PROFILE):
+    """
+    Incrementally updates and persists the index for an event gallery folder, then (re)builds its ANN index
+    if needed. Called from background ingest, never on the request path; matching uses get_gallery_index().
+    Returns:
+        GalleryIndex: The up-to-date index.
+    """
+    index = get_gallery_index(gallery_folder)
+    with index.update_lock:
+        if index.update(gallery_folder, profile):
+            index.save()
+        with profile.stage('(ANN index build)', 'ann'):
+            index.refresh_ann()
+    return index
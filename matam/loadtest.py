@@ -0,0 +1,436 @@
+"""
+End-to-end load test harness for the face matching app.
+Drives the real user flow (/upload_frames -> /store_email -> /status) against the Flask app in-process,
+with local in-process stand-ins for Supabase (user_requests table, matched-results storage) and SMTP.
+Reports throughput, p50/p95/p99 latency per endpoint, time-to-email and error rates, and checks that every
+email links to the results of its own request.
+
+Usage (from the matam/ folder, with at least one event gallery uploaded):
+    python loadtest.py --event my_event --rate 1.5 --duration 60 --frames 10 --source path/to/face.jpg
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from scheduler import percentile
+
+TERMINAL_STATUSES = {'done', 'no_face', 'no_frames', 'error', 'expired'}
+
+# --- Local stand-in for Supabase ---
+class LocalResult:
+    """
+    Mimics the response object returned by supabase-py's execute().
+    """
+    def __init__(self, data):
+        self.data = data
+
+class LocalQuery:
+    """
+    In-memory query builder supporting the subset of the PostgREST API the app uses.
+    """
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = 'select'
+        self.payload = None
+        self.filters = []
+        self.order_by = None
+        self.limit_n = None
+        self.single_row = False
+
+    def select(self, *columns):
+        self.action = 'select'
+        return self
+
+    def insert(self, row):
+        self.action = 'insert'
+        self.payload = row
+        return self
+
+    def update(self, values):
+        self.action = 'update'
+        self.payload = values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def execute(self):
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.action == 'insert':
+                new_rows = self.payload if isinstance(self.payload, list) else [self.payload]
+                for row in new_rows:
+                    row = dict(row)
+                    row.setdefault('created_at', datetime.utcnow().isoformat())
+                    rows.append(row)
+                return LocalResult([dict(r) for r in new_rows])
+            matched = [r for r in rows if all(f(r) for f in self.filters)]
+            if self.action == 'update':
+                for r in matched:
+                    r.update(self.payload)
+                return LocalResult([dict(r) for r in matched])
+            if self.action == 'delete':
+                self.db.tables[self.table] = [r for r in rows if r not in matched]
+                return LocalResult([dict(r) for r in matched])
+            if self.order_by:
+                column, desc = self.order_by
+                matched = sorted(matched, key=lambda r: r.get(column) or '', reverse=desc)
+            if self.limit_n is not None:
+                matched = matched[:self.limit_n]
+            if self.single_row:
+                if len(matched) != 1:
+                    raise RuntimeError(f"Expected a single row from {self.table}, got {len(matched)}")
+                return LocalResult(dict(matched[0]))
+            return LocalResult([dict(r) for r in matched])
+
+class LocalBucket:
+    """
+    In-memory storage bucket mimicking supabase.storage.from_(bucket).
+    """
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def upload(self, path, file, file_options=None):
+        data = file.read() if hasattr(file, 'read') else file
+        with self.db.lock:
+            self.db.buckets.setdefault(self.name, {})[path] = data
+        return {'Key': f"{self.name}/{path}"}
+
+    def get_public_url(self, path):
+        return f"http://localhost/storage/v1/object/public/{self.name}/{path}"
+
+    def remove(self, paths):
+        paths = [paths] if isinstance(paths, str) else paths
+        with self.db.lock:
+            bucket = self.db.buckets.setdefault(self.name, {})
+            for p in paths:
+                bucket.pop(p, None)
+        return paths
+
+class LocalStorage:
+    def __init__(self, db):
+        self.db = db
+
+    def from_(self, bucket):
+        return LocalBucket(self.db, bucket)
+
+class LocalSupabase:
+    """
+    Thread-safe in-process replacement for the Supabase client (tables + storage).
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.buckets = {}
+        self.storage = LocalStorage(self)
+
+    def table(self, name):
+        return LocalQuery(self, name)
+
+# --- Local stand-in for SMTP ---
+class MailRecorder:
+    """
+    Replaces Flask-Mail's send() and records when each recipient was emailed, and with what body.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+
+    def send(self, message):
+        now = time.time()
+        with self.lock:
+            for recipient in message.recipients:
+                self.sent.setdefault(recipient, []).append((now, message.body or ''))
+
+    def messages_for(self, recipient):
+        """
+        Returns (sent_at, body) for every email sent to recipient, oldest first.
+        """
+        with self.lock:
+            return list(self.sent.get(recipient, []))
+
+def load_app_with_stand_ins():
+    """
+    Imports app.py with Supabase and SMTP replaced by local stand-ins.
+    Returns:
+        tuple: (flask_app, LocalSupabase, MailRecorder)
+    """
+    for key, value in {
+        'MAIL_SERVER': 'localhost', 'MAIL_PORT': '25', 'MAIL_USE_TLS': 'False',
+        'MAIL_USERNAME': 'loadtest@example.test', 'MAIL_PASSWORD': 'loadtest',
+        'SUPABASE_URL': 'http://localhost', 'SUPABASE_KEY': 'loadtest', 'SECRET_KEY': 'loadtest',
+    }.items():
+        os.environ.setdefault(key, value)
+    db = LocalSupabase()
+    import supabase as supabase_pkg
+    supabase_pkg.create_client = lambda url, key, *args, **kwargs: db
+    import app as app_module
+    app_module.supabase = db
+    recorder = MailRecorder()
+    app_module.mail.send = recorder.send
+    return app_module.app, db, recorder
+
+# --- Frame payloads ---
+def build_frame_payloads(source_images, count, width=640, height=480, quality=80):
+    """
+    Builds webcam-like base64 JPEG data URLs from source images, with small per-frame jitter
+    (crop offset and brightness) so frames are not byte-identical.
+    Args:
+        source_images (list): Paths of images to sample frames from.
+        count (int): Number of frames to build.
+    Returns:
+        list: Data URLs, as sent by the frontend.
+    """
+    import cv2
+    sources = [img for img in (cv2.imread(p) for p in source_images) if img is not None]
+    if not sources:
+        raise RuntimeError('No readable source images for frame payloads.')
+    frames = []
+    for idx in range(count):
+        img = sources[idx % len(sources)]
+        h, w = img.shape[:2]
+        dx = random.randint(0, max(w // 20, 1))
+        dy = random.randint(0, max(h // 20, 1))
+        crop = img[dy:h - dy, dx:w - dx]
+        frame = cv2.resize(crop, (width, height))
+        frame = cv2.convertScaleAbs(frame, alpha=1.0, beta=random.uniform(-15, 15))
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            frames.append('data:image/jpeg;base64,' + base64.b64encode(buf.tobytes()).decode('ascii'))
+    return frames
+
+def sources_with_faces(source_images):
+    """
+    Returns the source image paths in which a face is detected, so sessions are not all no_face by construction.
+    """
+    import cv2
+    import face_recognition
+    found = []
+    for path in source_images:
+        img = cv2.imread(path)
+        if img is not None and face_recognition.face_locations(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)):
+            found.append(path)
+        else:
+            print(f"⚠️ No face detected in source image {path}; skipping it.")
+    return found
+
+# --- Load generation ---
+class LoadStats:
+    """
+    Thread-safe collector of per-endpoint latencies, errors and end-to-end times.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.calls = {}
+        self.time_to_email = []
+        self.final_statuses = {}
+        self.sessions = 0
+        self.timeouts = 0
+        self.delivery_errors = {}
+
+    def record_call(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def record_delivery_error(self, kind):
+        with self.lock:
+            self.delivery_errors[kind] = self.delivery_errors.get(kind, 0) + 1
+
+    def record_session(self, final_status, email_seconds):
+        with self.lock:
+            self.sessions += 1
+            self.final_statuses[final_status] = self.final_statuses.get(final_status, 0) + 1
+            if final_status == 'timeout':
+                self.timeouts += 1
+            if email_seconds is not None:
+                self.time_to_email.append(email_seconds)
+
+    def report(self, elapsed):
+        with self.lock:
+            endpoints = {}
+            for endpoint, values in self.latencies.items():
+                calls = self.calls[endpoint]
+                endpoints[endpoint] = {
+                    'calls': calls,
+                    'throughput_rps': round(calls / elapsed, 3) if elapsed else None,
+                    'p50_ms': _ms(percentile(values, 50)),
+                    'p95_ms': _ms(percentile(values, 95)),
+                    'p99_ms': _ms(percentile(values, 99)),
+                    'error_rate': round(self.errors.get(endpoint, 0) / calls, 4),
+                }
+            return {
+                'elapsed_seconds': round(elapsed, 2),
+                'sessions': self.sessions,
+                'sessions_per_second': round(self.sessions / elapsed, 3) if elapsed else None,
+                'emails_sent': len(self.time_to_email),
+                'time_to_email_p50_s': _round(percentile(self.time_to_email, 50)),
+                'time_to_email_p95_s': _round(percentile(self.time_to_email, 95)),
+                'time_to_email_p99_s': _round(percentile(self.time_to_email, 99)),
+                'final_statuses': dict(self.final_statuses),
+                'timeouts': self.timeouts,
+                'delivery_errors': dict(self.delivery_errors),
+                'endpoints': endpoints,
+            }
+
+def _ms(value):
+    return None if value is None else round(value * 1000, 1)
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+def _timed_call(client, stats, endpoint, method, **kwargs):
+    start = time.time()
+    try:
+        resp = client.open(endpoint, method=method, **kwargs)
+        data = resp.get_json(silent=True) or {}
+        ok = resp.status_code < 400 and data.get('status') != 'error'
+    except Exception as e:
+        print(f"[LOADTEST] {endpoint} raised: {e}")
+        data, ok = {}, False
+    stats.record_call(endpoint, time.time() - start, ok)
+    return data
+
+def run_session(flask_app, recorder, stats, frames, event_name, poll_interval, session_timeout):
+    """
+    Runs one simulated user: upload frames, submit email, poll status until the request finishes.
+    """
+    client = flask_app.test_client()
+    request_id = str(uuid.uuid4())
+    email = f"load_{request_id[:8]}@example.test"
+    _timed_call(client, stats, '/upload_frames', 'POST', json={'frames': frames, 'request_id': request_id})
+    submitted = time.time()
+    data = _timed_call(client, stats, '/store_email', 'POST',
+                       json={'email': email, 'request_id': request_id, 'event_name': event_name})
+    final_status = data.get('status') if data.get('status') == 'error' else 'timeout'
+    if final_status != 'error':
+        while time.time() - submitted < session_timeout:
+            time.sleep(poll_interval)
+            data = _timed_call(client, stats, '/status', 'GET', query_string={'request_id': request_id})
+            if data.get('status') in TERMINAL_STATUSES:
+                final_status = data['status']
+                break
+    messages = recorder.messages_for(email)
+    # Every email must link to this session's own results (zip names end in _<request_id>.zip)
+    for _, body in messages:
+        if request_id not in body:
+            print(f"[LOADTEST] Email for request_id={request_id} links to another request's results")
+            stats.record_delivery_error('wrong_request')
+    if final_status == 'done' and not messages:
+        stats.record_delivery_error('missing_email')
+    if len(messages) > 1:
+        stats.record_delivery_error('duplicate_email')
+    stats.record_session(final_status, messages[0][0] - submitted if messages else None)
+
+def run_load(flask_app, recorder, frames, event_name, rate, duration, poll_interval=1.0, session_timeout=600.0):
+    """
+    Starts simulated users with Poisson arrivals at `rate` per second for `duration` seconds,
+    then waits for all of them to finish.
+    Returns:
+        dict: The load test report.
+    """
+    stats = LoadStats()
+    threads = []
+    start = time.time()
+    next_arrival = start
+    while next_arrival - start < duration:
+        time.sleep(max(next_arrival - time.time(), 0))
+        t = threading.Thread(target=run_session, daemon=True,
+                             args=(flask_app, recorder, stats, frames, event_name, poll_interval, session_timeout))
+        t.start()
+        threads.append(t)
+        next_arrival += random.expovariate(rate)
+    for t in threads:
+        t.join(session_timeout + 60)
+    return stats.report(time.time() - start)
+
+def print_report(report):
+    print(f"\n=== Load test: {report['sessions']} sessions in {report['elapsed_seconds']}s "
+          f"({report['sessions_per_second']} sessions/s) ===")
+    print(f"{'endpoint':<16}{'calls':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for endpoint, e in report['endpoints'].items():
+        print(f"{endpoint:<16}{e['calls']:>8}{e['throughput_rps']:>9}{str(e['p50_ms']):>10}"
+              f"{str(e['p95_ms']):>10}{str(e['p99_ms']):>10}{e['error_rate']:>9.2%}")
+    print(f"\nEmails sent: {report['emails_sent']}  time-to-email p50/p95/p99 (s): "
+          f"{report['time_to_email_p50_s']} / {report['time_to_email_p95_s']} / {report['time_to_email_p99_s']}")
+    print(f"Final statuses: {report['final_statuses']}")
+    if report['delivery_errors']:
+        print(f"❌ Delivery errors: {report['delivery_errors']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end load test with local Supabase and SMTP stand-ins.')
+    parser.add_argument('--event', help='Event gallery to match against (default: first event found).')
+    parser.add_argument('--rate', type=float, default=1.0, help='Mean user arrivals per second.')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to generate arrivals for.')
+    parser.add_argument('--frames', type=int, default=10, help='Frames uploaded per user.')
+    parser.add_argument('--source', nargs='+', required=True,
+                        help='Images of a face to build frame payloads from (use real captures of someone in the gallery).')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between /status polls.')
+    parser.add_argument('--session-timeout', type=float, default=600.0, help='Give up on a request after this many seconds.')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible arrivals.')
+    parser.add_argument('--json', dest='json_out', help='Also write the report to this JSON file.')
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    flask_app, db, recorder = load_app_with_stand_ins()
+    from app import GALLERY_FOLDER
+    event_name = args.event
+    if not event_name:
+        events = sorted(d for d in os.listdir(GALLERY_FOLDER)
+                        if os.path.isdir(os.path.join(GALLERY_FOLDER, d)) and not d.startswith('.')) \
+            if os.path.isdir(GALLERY_FOLDER) else []
+        if not events:
+            print('❌ No event galleries found. Upload a gallery or pass --event.')
+            return 1
+        event_name = events[0]
+    sources = sources_with_faces(args.source)
+    if not sources:
+        print('❌ No face detected in any --source image; every session would end as no_face.')
+        return 1
+    frames = build_frame_payloads(sources, args.frames)
+    print(f"🚀 Load test: event={event_name} rate={args.rate}/s duration={args.duration}s frames={len(frames)}")
+    report = run_load(flask_app, recorder, frames, event_name, args.rate, args.duration,
+                      args.poll_interval, args.session_timeout)
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['delivery_errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,20 +2,28 @@
 Script for capturing a face from webcam, extracting encodings, and matching against gallery images.
 """
 import cv2
-import face_recognition
 import numpy as np
 import os
 import shutil
 import time
+from gallery_index import get_gallery_index, list_gallery_images, scan_gallery_images, update_gallery_index
+from video_ingest import save_video_matches
+from profiling import NULL_PROFILE
+from face_encoding import encode_frames
 
-def run_face_matching(reference_frames_dir, gallery_folder):
+def run_face_matching(reference_frames, gallery_folder, profile=NULL_PROFILE, matched_folder="static/matched"):
     """
-    Given a directory of reference frames (images), extract face encodings and match against gallery images in the specified gallery_folder.
-    Saves matched images to MATCHED_FOLDER as before.
+    Given reference frames (a list of decoded BGR images, or a directory of images), extract face encodings and match against gallery images in the specified gallery_folder.
+    Gallery faces come from the event's gallery index (encoded once, grouped into identity clusters), so only
+    clusters that can contain the requester are compared. The index is kept up to date by the background
+    gallery ingest; matching never waits for it, and images it does not cover yet (new uploads, or a gallery
+    not indexed since deploy) are compared directly instead. Saves matched images to matched_folder, which is emptied first.
+    profile (MatchProfile) receives per-image stage timings when the run is being profiled.
+    matched_folder must not be shared with another run in progress (the app gives each request its own).
     """
     # --- Config ---
     MATCH_THRESHOLD = 0.45
-    MATCHED_FOLDER = "static/matched"
+    MATCHED_FOLDER = matched_folder
 
     # --- Prepare matched_faces folder ---
     if os.path.exists(MATCHED_FOLDER):
@@ -24,53 +32,62 @@ def run_face_matching(reference_frames_dir, gallery_folder):
 
     # --- Step 1: Load Reference Frames ---
     captured_frames = []
-    for fname in sorted(os.listdir(reference_frames_dir)):
-        if fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-            frame = cv2.imread(os.path.join(reference_frames_dir, fname))
-            if frame is not None:
-                captured_frames.append(frame)
-    print(f"✅ Loaded {len(captured_frames)} reference frames from {reference_frames_dir}.")
+    if isinstance(reference_frames, str):
+        for fname in sorted(os.listdir(reference_frames)):
+            if fname.lower().endswith(('.jpg', '.jpeg', '.png')):
+                with profile.stage(f"reference/{fname}", 'load'):
+                    frame = cv2.imread(os.path.join(reference_frames, fname))
+                if frame is not None:
+                    captured_frames.append((f"reference/{fname}", frame))
+    else:
+        captured_frames = [(f"reference/frame_{idx + 1:03d}", frame) for idx, frame in enumerate(reference_frames)]
+    print(f"✅ Loaded {len(captured_frames)} reference frames.")
     if not captured_frames:
-        print("❌ No frames found in reference directory.")
+        print("❌ No reference frames found.")
         return 0
 
     # --- Step 2: Extract ALL Face Encodings from Captured Frames ---
-    ref_encodings = []
-    for frame in captured_frames:
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        faces = face_recognition.face_encodings(rgb)
-        ref_encodings.extend(faces)
+    rgb_frames = [(name, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for name, frame in captured_frames]
+    ref_encodings = encode_frames(rgb_frames, profile=profile)
     if not ref_encodings:
         print("❌ No face detected in reference frames.")
         return 0
     print(f"🧠 Stored {len(ref_encodings)} reference encodings.\n")
 
-    # --- Step 3: Match Against Group Photos ---
+    # --- Step 3: Match Against Indexed Group Photo Faces ---
+    index = get_gallery_index(gallery_folder)
+    with index.lock, profile.stage('(gallery index query)', 'match'):
+        stale, unindexed = index.pending_changes(list_gallery_images(gallery_folder))
+        hits = index.match(np.asarray(ref_encodings), MATCH_THRESHOLD)
+    # Indexed faces of removed or changed images are outdated; changed images are rescanned below
+    hits = [hit for hit in hits if hit[0] not in stale]
+    if unindexed:
+        print(f"⏳ {len(unindexed)} image(s) of '{index.event_name}' are not indexed yet; comparing them directly.")
+        hits.extend(scan_gallery_images(gallery_folder, unindexed, np.asarray(ref_encodings),
+                                        MATCH_THRESHOLD, profile))
+    matches_by_file = {}
+    for filename, location, min_dist in hits:
+        matches_by_file.setdefault(filename, []).append((location, min_dist))
+
+    # --- Step 4: Save Matched Group Photos ---
     match_count = 0
-    for filename in os.listdir(gallery_folder):
-        path = os.path.join(gallery_folder, filename)
-        img_bgr = cv2.imread(path)
-        if img_bgr is None:
-            continue
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(img_rgb)
-        face_encodings = face_recognition.face_encodings(img_rgb, face_locations)
-        matched = False
-        for i, enc in enumerate(face_encodings):
-            distances = [np.linalg.norm(enc - ref) for ref in ref_encodings]
-            min_dist = min(distances)
-            if min_dist < MATCH_THRESHOLD:
-                matched = True
-                top, right, bottom, left = face_locations[i]
+    for filename, faces in matches_by_file.items():
+        with profile.stage(filename, 'save'):
+            img_bgr = cv2.imread(os.path.join(gallery_folder, filename))
+            if img_bgr is None:
+                continue
+            out_clean_path = os.path.join(MATCHED_FOLDER, f"clean_{filename}")
+            cv2.imwrite(out_clean_path, img_bgr)
+            for (top, right, bottom, left), min_dist in faces:
                 cv2.rectangle(img_bgr, (left, top), (right, bottom), (0, 255, 0), 2)
                 cv2.putText(img_bgr, f"{min_dist:.2f}", (left, top - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-        if matched:
-            out_clean_path = os.path.join(MATCHED_FOLDER, f"clean_{filename}")
-            cv2.imwrite(out_clean_path, img_rgb[:, :, ::-1])
             out_path = os.path.join(MATCHED_FOLDER, filename)
             cv2.imwrite(out_path, img_bgr)
-            match_count += 1
+        match_count += 1
+    video_match_count = save_video_matches(MATCHED_FOLDER, gallery_folder, list(matches_by_file))
+    if video_match_count:
+        print(f"🎞️ {video_match_count} of the matches are video keyframes.")
     print(f"\n🎯 {match_count} group image(s) with at least one match saved to '{MATCHED_FOLDER}'.")
     if match_count == 0:
         print("🚫 No perfect matches found.")
@@ -102,9 +119,6 @@ if __name__ == "__main__":
     cap.release()
     cv2.destroyAllWindows()
     cv2.waitKey(1)
-    # Save frames to temp dir and run matching
-    import tempfile
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for idx, frame in enumerate(captured_frames):
-            cv2.imwrite(os.path.join(tmpdir, f'frame_{idx+1:03d}.jpg'), frame)
-        run_face_matching(tmpdir, "static/gallery")
\ No newline at end of file
+    # Bring the gallery index up to date (the app does this on upload), then match the captured frames
+    update_gallery_index("static/gallery")
+    run_face_matching(captured_frames, "static/gallery")
\ No newline at end of file
@@ -0,0 +1,239 @@
+"""
+On-demand profiling of live matching runs.
+An admin arms the control for the next N matching runs (optionally only for one event). Gallery ingest runs,
+where gallery images are detected and encoded into the event's index, claim profiles the same way. Those runs execute
+under a deterministic (cProfile) or sampling profiler with per-image stage timing, and the profile plus a
+slowest-first per-image report are saved under PROFILES_FOLDER for download from the admin dashboard.
+When the control is not armed, runs get NULL_PROFILE, whose stage timing does nothing.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+PROFILES_FOLDER = 'profiles'
+MODE_DETERMINISTIC = 'deterministic'
+MODE_SAMPLING = 'sampling'
+MODES = (MODE_DETERMINISTIC, MODE_SAMPLING)
+# Seconds between stack samples in sampling mode
+SAMPLING_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+# Files a profile folder may contain, and that can be downloaded
+PROFILE_FILES = ('meta.json', 'report.json', 'report.txt', 'profile.prof', 'profile.txt', 'stacks.collapsed')
+
+_NULL_CONTEXT = nullcontext()
+
+class NullProfile:
+    """
+    Used when profiling is off: stage timing and notes are no-ops.
+    """
+    def stage(self, image, name):
+        return _NULL_CONTEXT
+
+    def note(self, image, **info):
+        pass
+
+    def finish(self, **summary):
+        pass
+
+NULL_PROFILE = NullProfile()
+
+class MatchProfile:
+    """
+    Profiles one matching run: a whole-run profiler plus per-image stage timings.
+    Must be started and finished on the thread that runs the matching.
+    """
+    def __init__(self, request_id, event_name, mode):
+        # profile_id names a folder, so only safe characters of the client-supplied request_id are kept
+        safe_request_id = re.sub(r'[^A-Za-z0-9-]', '', request_id)[:8]
+        self.profile_id = f"{datetime.utcnow():%Y%m%d_%H%M%S}_{safe_request_id}_{os.urandom(2).hex()}"
+        self.request_id = request_id
+        self.event_name = event_name
+        self.mode = mode
+        self.image_stages = {}
+        self.image_info = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._stacks = None
+        self._stop = None
+        self._sampler = None
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.time()
+        if self.mode == MODE_DETERMINISTIC:
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another run is already under cProfile on this interpreter; sample this one instead
+                self._profiler = None
+                self.mode = MODE_SAMPLING
+        if self.mode == MODE_SAMPLING:
+            self._stacks = Counter()
+            self._stop = threading.Event()
+            target = threading.get_ident()
+            self._sampler = threading.Thread(target=self._sample, args=(target,), daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample(self, target):
+        while not self._stop.wait(SAMPLING_INTERVAL):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self._stacks[';'.join(reversed(stack))] += 1
+
+    @contextmanager
+    def stage(self, image, name):
+        """
+        Times one stage (e.g. 'load', 'detect', 'encode') of processing an image.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stages = self.image_stages.setdefault(image, {})
+                stages[name] = stages.get(name, 0.0) + elapsed
+
+    def note(self, image, **info):
+        """
+        Attaches details to an image's report entry, e.g. width, height, faces.
+        """
+        with self._lock:
+            self.image_info.setdefault(image, {}).update(info)
+
+    def finish(self, **summary):
+        """
+        Stops profiling and writes the profile and per-image report to PROFILES_FOLDER/<profile_id>/.
+        Args:
+            summary: Extra run details to store in meta.json (e.g. match_count).
+        """
+        duration = time.time() - self._started_at
+        folder = os.path.join(PROFILES_FOLDER, self.profile_id)
+        os.makedirs(folder, exist_ok=True)
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(os.path.join(folder, 'profile.prof'))
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(60)
+            with open(os.path.join(folder, 'profile.txt'), 'w') as f:
+                f.write(out.getvalue())
+        if self._stop is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._write_samples(folder)
+
+        images = []
+        for image, stages in self.image_stages.items():
+            entry = {'image': image, 'total_seconds': round(sum(stages.values()), 4),
+                     'stages': {k: round(v, 4) for k, v in stages.items()}}
+            entry.update(self.image_info.get(image, {}))
+            images.append(entry)
+        images.sort(key=lambda e: e['total_seconds'], reverse=True)
+        with open(os.path.join(folder, 'report.json'), 'w') as f:
+            json.dump(images, f, indent=2)
+        with open(os.path.join(folder, 'report.txt'), 'w') as f:
+            f.write(f"Request {self.request_id} / event {self.event_name} / {self.mode} / {duration:.2f}s\n\n")
+            f.write(f"{'seconds':>9}  {'image':<48} stages / details\n")
+            for e in images:
+                stages = ' '.join(f"{k}={v:.3f}" for k, v in e['stages'].items())
+                details = ' '.join(f"{k}={v}" for k, v in e.items() if k not in ('image', 'total_seconds', 'stages'))
+                f.write(f"{e['total_seconds']:>9.3f}  {e['image']:<48} {stages} {details}\n")
+        meta = {
+            'profile_id': self.profile_id,
+            'request_id': self.request_id,
+            'event_name': self.event_name,
+            'mode': self.mode,
+            'started_at': datetime.utcfromtimestamp(self._started_at).isoformat(),
+            'duration_seconds': round(duration, 3),
+            'images': len(images),
+            'slowest_image': images[0]['image'] if images else None,
+        }
+        meta.update(summary)
+        with open(os.path.join(folder, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        print(f"🩺 Saved {self.mode} profile {self.profile_id} ({len(images)} images, {duration:.2f}s).")
+
+    def _write_samples(self, folder):
+        # Collapsed stacks (one 'frame;frame;frame count' line each) load directly into flame graph tools
+        with open(os.path.join(folder, 'stacks.collapsed'), 'w') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self_counts = Counter()
+        total = sum(self._stacks.values()) or 1
+        for stack, count in self._stacks.items():
+            self_counts[stack.rsplit(';', 1)[-1]] += count
+        with open(os.path.join(folder, 'profile.txt'), 'w') as f:
+            f.write(f"{total} samples every {SAMPLING_INTERVAL * 1000:.0f} ms; top functions by own samples\n\n")
+            for func, count in self_counts.most_common(60):
+                f.write(f"{count:>7} {count / total:>7.1%}  {func}\n")
+
+class ProfilingControl:
+    """
+    Admin switch that hands out profiles to the next N matching runs, optionally restricted to one event.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs_left = 0
+        self._event_name = None
+        self._mode = MODE_SAMPLING
+
+    def arm(self, runs, event_name=None, mode=MODE_SAMPLING):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        with self._lock:
+            self._runs_left = max(int(runs), 0)
+            self._event_name = event_name or None
+            self._mode = mode
+
+    def disarm(self):
+        self.arm(0)
+
+    def status(self):
+        with self._lock:
+            return {'runs_left': self._runs_left, 'event_name': self._event_name, 'mode': self._mode}
+
+    def claim(self, request_id, event_name):
+        """
+        Returns a started MatchProfile if this run should be profiled, else NULL_PROFILE.
+        Call on the thread that runs the matching.
+        """
+        if not self._runs_left:
+            return NULL_PROFILE
+        with self._lock:
+            if not self._runs_left or (self._event_name and self._event_name != event_name):
+                return NULL_PROFILE
+            self._runs_left -= 1
+            mode = self._mode
+        return MatchProfile(request_id, event_name, mode).start()
+
+def list_profiles():
+    """
+    Returns metadata of saved profiles, newest first.
+    """
+    if not os.path.isdir(PROFILES_FOLDER):
+        return []
+    profiles = []
+    for profile_id in sorted(os.listdir(PROFILES_FOLDER), reverse=True):
+        meta_path = os.path.join(PROFILES_FOLDER, profile_id, 'meta.json')
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            meta['files'] = [n for n in PROFILE_FILES if os.path.isfile(os.path.join(PROFILES_FOLDER, profile_id, n))]
+            profiles.append(meta)
+    return profiles
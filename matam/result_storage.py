@@ -0,0 +1,177 @@
+"""
+Pluggable storage backends for matched-result zip files.
+- SupabaseResultStorage: uploads to the Supabase Storage bucket and returns its public URL (original behavior).
+- LocalResultStorage: keeps zips on local disk and serves them through expiring HMAC-signed URLs.
+Select a backend with the RESULT_STORAGE environment variable ('supabase' or 'local').
+"""
+import hashlib
+import hmac
+import os
+import re
+import shutil
+import time
+from urllib.parse import quote, unquote, urlencode
+
+RESULTS_BUCKET = 'matched-results'
+RESULTS_FOLDER = 'results'
+RESULT_TTL_SECONDS = int(os.getenv('RESULT_TTL_SECONDS', '3600'))
+
+def format_ttl(seconds):
+    """
+    Human-readable link lifetime for emails, e.g. '1 hour', '30 minutes', '2 days'.
+    """
+    for unit, size in (('day', 86400), ('hour', 3600), ('minute', 60)):
+        if seconds >= size and seconds % size == 0:
+            count = seconds // size
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return f"{seconds} seconds"
+
+class ResultStorage:
+    """
+    Interface for storing result zips and producing download URLs.
+    Stored zips (and their links) are kept for ttl seconds.
+    """
+    ttl = RESULT_TTL_SECONDS
+
+    def save(self, zip_path, filename):
+        """
+        Stores the zip at zip_path under filename.
+        Returns:
+            str: URL the user can download the zip from.
+        """
+        raise NotImplementedError
+
+    def delete(self, filename):
+        """
+        Deletes a stored zip by filename.
+        """
+        raise NotImplementedError
+
+    def cleanup_expired(self):
+        """
+        Deletes stored zips older than the result TTL that the backend tracks itself.
+        Returns:
+            int: Number of zips deleted.
+        """
+        return 0
+
+    @staticmethod
+    def filename_from_url(url):
+        """
+        Extracts the stored filename from a download URL.
+        """
+        return unquote(url.split('/')[-1].split('?')[0])
+
+class SupabaseResultStorage(ResultStorage):
+    """
+    Stores result zips in Supabase Storage.
+    """
+    def __init__(self, supabase, bucket_name=RESULTS_BUCKET, ttl=RESULT_TTL_SECONDS):
+        self.supabase = supabase
+        self.bucket_name = bucket_name
+        self.ttl = ttl
+
+    def save(self, zip_path, filename):
+        with open(zip_path, "rb") as f:
+            upload_response = self.supabase.storage.from_(self.bucket_name).upload(
+                filename, f, {"content-type": "application/zip", "x-upsert": "true"}
+            )
+        print('DEBUG: [storage] Uploaded zip, response:', upload_response)
+        return self.supabase.storage.from_(self.bucket_name).get_public_url(filename)
+
+    def delete(self, filename):
+        self.supabase.storage.from_(self.bucket_name).remove(filename)
+
+class LocalResultStorage(ResultStorage):
+    """
+    Stores result zips on local disk and hands out HMAC-signed download URLs that expire after ttl seconds.
+    Expired zips are removed by cleanup_expired(), no network calls involved.
+    Filenames are reduced to safe_filename() once, when saving; URLs are signed over and serve that name.
+    """
+    def __init__(self, secret_key, folder=RESULTS_FOLDER, base_url='', ttl=RESULT_TTL_SECONDS):
+        if not secret_key:
+            raise RuntimeError('Local result storage needs RESULT_SIGNING_KEY or SECRET_KEY to sign URLs.')
+        self.secret_key = secret_key.encode() if isinstance(secret_key, str) else secret_key
+        self.folder = folder
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def safe_filename(filename):
+        """
+        Reduces a filename to letters, digits, '.', '_' and '-' (e.g. the '+' of 'john+tag@gmail.com' becomes '_').
+        """
+        return re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(filename)).lstrip('.') or 'result.zip'
+
+    def sign(self, filename, expires):
+        """
+        Returns the hex HMAC-SHA256 signature for filename and expiry timestamp.
+        """
+        message = f"{filename}:{int(expires)}".encode()
+        return hmac.new(self.secret_key, message, hashlib.sha256).hexdigest()
+
+    def signed_url(self, filename, expires=None):
+        """
+        Builds an expiring download URL for a stored zip.
+        """
+        if expires is None:
+            expires = int(time.time()) + self.ttl
+        query = urlencode({'expires': int(expires), 'sig': self.sign(filename, expires)})
+        return f"{self.base_url}/results/{quote(filename)}?{query}"
+
+    def verify(self, filename, expires, signature):
+        """
+        Checks that a download URL's signature is valid and it has not expired.
+        Returns:
+            bool: True if the download should be allowed.
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time() or not signature:
+            return False
+        return hmac.compare_digest(self.sign(filename, expires), signature)
+
+    def path_for(self, filename):
+        return os.path.join(self.folder, os.path.basename(filename))
+
+    def save(self, zip_path, filename):
+        filename = self.safe_filename(filename)
+        shutil.move(zip_path, self.path_for(filename))
+        return self.signed_url(filename)
+
+    def delete(self, filename):
+        path = self.path_for(filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def cleanup_expired(self):
+        cutoff = time.time() - self.ttl
+        deleted = 0
+        for fname in os.listdir(self.folder):
+            fpath = os.path.join(self.folder, fname)
+            if os.path.isfile(fpath) and os.path.getmtime(fpath) < cutoff:
+                os.remove(fpath)
+                deleted += 1
+        return deleted
+
+def create_result_storage(supabase, secret_key=None):
+    """
+    Builds the result storage backend selected by the RESULT_STORAGE environment variable.
+    Args:
+        supabase: Supabase client, used by the 'supabase' backend.
+        secret_key (str): Fallback signing key for the 'local' backend if RESULT_SIGNING_KEY is not set.
+    Returns:
+        ResultStorage: The configured backend.
+    """
+    backend = os.getenv('RESULT_STORAGE', 'supabase').lower()
+    if backend == 'local':
+        return LocalResultStorage(
+            os.getenv('RESULT_SIGNING_KEY') or secret_key,
+            base_url=os.getenv('PUBLIC_BASE_URL', 'http://localhost:5002'),
+        )
+    if backend == 'supabase':
+        return SupabaseResultStorage(supabase)
+    raise RuntimeError(f"Unknown RESULT_STORAGE backend: {backend}")
@@ -0,0 +1,273 @@
+"""
+Size-aware scheduler for face matching jobs.
+Orders pending matching work by estimated cost so a request against a huge event
+does not stall requests against small events, and records completion-time metrics per policy.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+# Supported scheduling policies
+POLICY_SJF_AGING = 'sjf'     # Shortest job first, with aging so big jobs are not starved
+POLICY_FAIR_SHARE = 'fair'   # Weighted fair share of matching work across events
+POLICIES = (POLICY_SJF_AGING, POLICY_FAIR_SHARE)
+
+# Cost units (images) a waiting job is credited per second of waiting under SJF
+AGING_RATE = float(os.getenv('MATCH_SCHEDULER_AGING_RATE', '50'))
+# Completed jobs kept per policy for percentile metrics
+METRICS_WINDOW = 1000
+
+_cost_cache = {}
+_cost_cache_lock = threading.Lock()
+
+def estimate_event_cost(event_gallery_folder):
+    """
+    Estimates the cost of a matching job from the number of images in the event's gallery folder.
+    The count is cached until the folder's modification time changes.
+    Args:
+        event_gallery_folder (str): Path to the event's gallery folder.
+    Returns:
+        int: Estimated cost in images (at least 1).
+    """
+    try:
+        mtime = os.path.getmtime(event_gallery_folder)
+    except OSError:
+        return 1
+    with _cost_cache_lock:
+        cached = _cost_cache.get(event_gallery_folder)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    count = sum(1 for f in os.listdir(event_gallery_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    cost = max(count, 1)
+    with _cost_cache_lock:
+        _cost_cache[event_gallery_folder] = (mtime, cost)
+    return cost
+
+def parse_event_weights(spec):
+    """
+    Parses fair-share event weights from a 'event_a:2,event_b:0.5' string (e.g. MATCH_EVENT_WEIGHTS).
+    Returns:
+        dict: {event_name: weight}
+    """
+    weights = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        event_name, sep, weight = item.rpartition(':')
+        if not sep or not event_name.strip():
+            raise ValueError(f"Invalid event weight entry: {item!r} (expected event:weight)")
+        weights[event_name.strip()] = float(weight)
+    return weights
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    Returns:
+        float or None: The percentile value, or None if values is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+class MatchJob:
+    """
+    A queued matching job for one user request.
+    """
+    def __init__(self, request_id, event_name, cost, target):
+        self.request_id = request_id
+        self.event_name = event_name
+        self.cost = cost
+        self.target = target
+        self.submitted_at = time.time()
+        self.started_at = None
+
+class MatchScheduler:
+    """
+    Runs matching jobs on a fixed pool of worker threads, choosing the next job by policy
+    instead of arrival order.
+    """
+    def __init__(self, policy=POLICY_SJF_AGING, workers=1, aging_rate=AGING_RATE, event_weights=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.policy = policy
+        self.workers = max(int(workers), 1)
+        self.aging_rate = aging_rate
+        self._pending = []
+        self._running = {}
+        self._event_weights = {e: max(float(w), 0.01) for e, w in (event_weights or {}).items()}
+        self._event_vtime = {}
+        self._seconds_per_cost = None
+        self._completion_times = {p: deque(maxlen=METRICS_WINDOW) for p in POLICIES}
+        self._queue_times = {p: deque(maxlen=METRICS_WINDOW) for p in POLICIES}
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        """
+        Starts the worker threads. Safe to call more than once.
+        """
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def set_policy(self, policy):
+        """
+        Switches the policy used for subsequent dispatch decisions.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        with self._cond:
+            self.policy = policy
+
+    def set_event_weight(self, event_name, weight):
+        """
+        Sets the fair-share weight of an event (default 1). Higher weight gets a larger share.
+        """
+        with self._cond:
+            self._event_weights[event_name] = max(float(weight), 0.01)
+
+    def event_weights(self):
+        """
+        Returns the configured fair-share weights; events not listed have weight 1.
+        """
+        with self._cond:
+            return dict(self._event_weights)
+
+    def submit(self, request_id, event_name, target, cost=1):
+        """
+        Queues a matching job.
+        Args:
+            request_id (str): The user request this job belongs to.
+            event_name (str): Event whose gallery is matched against.
+            target (callable): Function that performs the matching work.
+            cost (int): Estimated cost, e.g. the number of images in the event gallery.
+        """
+        job = MatchJob(request_id, event_name, max(int(cost), 1), target)
+        with self._cond:
+            if self.policy == POLICY_FAIR_SHARE and not self._has_event_work(event_name):
+                # A newly active event starts at the current minimum virtual time, not at zero
+                active = [j.event_name for j in self._pending] + [j.event_name for j in self._running.values()]
+                if not active:
+                    self._event_vtime.clear()  # Idle system: nobody carries old usage forward
+                floor = min((self._event_vtime.get(e, 0.0) for e in active), default=0.0)
+                self._event_vtime[event_name] = max(self._event_vtime.get(event_name, 0.0), floor)
+            self._pending.append(job)
+            self._cond.notify()
+        print(f"[SCHED] Queued request_id={request_id} event={event_name} cost={job.cost} policy={self.policy}")
+        return job
+
+    def _has_event_work(self, event_name):
+        return any(j.event_name == event_name for j in self._pending) or \
+            any(j.event_name == event_name for j in self._running.values())
+
+    def _dispatch_order(self, now):
+        """
+        Returns pending jobs in the order the current policy would start them. Caller holds the lock.
+        """
+        if self.policy == POLICY_SJF_AGING:
+            return sorted(self._pending, key=lambda j: (j.cost - self.aging_rate * (now - j.submitted_at), j.submitted_at))
+        # Weighted fair share: simulate serving the event with the lowest virtual time first
+        per_event = {}
+        for job in sorted(self._pending, key=lambda j: j.submitted_at):
+            per_event.setdefault(job.event_name, deque()).append(job)
+        vtime = {e: self._event_vtime.get(e, 0.0) for e in per_event}
+        order = []
+        while per_event:
+            event = min(per_event, key=lambda e: (vtime[e], per_event[e][0].submitted_at))
+            job = per_event[event].popleft()
+            order.append(job)
+            vtime[event] += job.cost / self._event_weights.get(event, 1.0)
+            if not per_event[event]:
+                del per_event[event]
+        return order
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._dispatch_order(time.time())[0]
+                self._pending.remove(job)
+                job.started_at = time.time()
+                self._running[job.request_id] = job
+                if self.policy == POLICY_FAIR_SHARE:
+                    weight = self._event_weights.get(job.event_name, 1.0)
+                    self._event_vtime[job.event_name] = self._event_vtime.get(job.event_name, 0.0) + job.cost / weight
+                policy = self.policy
+            try:
+                job.target()
+            except Exception as e:
+                print(f"[SCHED] Job for request_id={job.request_id} failed: {e}")
+            finished = time.time()
+            with self._cond:
+                self._running.pop(job.request_id, None)
+                per_cost = (finished - job.started_at) / job.cost
+                if self._seconds_per_cost is None:
+                    self._seconds_per_cost = per_cost
+                else:
+                    self._seconds_per_cost = 0.8 * self._seconds_per_cost + 0.2 * per_cost
+                self._completion_times[policy].append(finished - job.submitted_at)
+                self._queue_times[policy].append(job.started_at - job.submitted_at)
+            print(f"[SCHED] Finished request_id={job.request_id} in {finished - job.submitted_at:.2f}s (policy={policy})")
+
+    def queue_info(self, request_id):
+        """
+        Returns queue position and estimated wait for a request.
+        Returns:
+            dict or None: {'state': 'queued', 'queue_position': int, 'estimated_wait_seconds': float or None},
+                          {'state': 'running', ...}, or None if the request is not known to the scheduler.
+        """
+        now = time.time()
+        with self._cond:
+            if request_id in self._running:
+                return {'state': 'running', 'queue_position': 0, 'estimated_wait_seconds': 0}
+            order = self._dispatch_order(now)
+            for idx, job in enumerate(order):
+                if job.request_id == request_id:
+                    break
+            else:
+                return None
+            estimate = None
+            if self._seconds_per_cost is not None:
+                ahead = sum(j.cost for j in order[:idx])
+                running_left = sum(max(j.cost * self._seconds_per_cost - (now - j.started_at), 0)
+                                   for j in self._running.values())
+                estimate = round((ahead * self._seconds_per_cost + running_left) / self.workers, 1)
+            return {'state': 'queued', 'queue_position': idx + 1, 'estimated_wait_seconds': estimate}
+
+    def metrics(self):
+        """
+        Returns queue depth and p50/p95 completion and queueing times for each policy.
+        Returns:
+            dict: Scheduler metrics suitable for JSON output.
+        """
+        with self._cond:
+            per_policy = {}
+            for p in POLICIES:
+                completions = list(self._completion_times[p])
+                waits = list(self._queue_times[p])
+                per_policy[p] = {
+                    'completed': len(completions),
+                    'completion_p50': percentile(completions, 50),
+                    'completion_p95': percentile(completions, 95),
+                    'queue_wait_p50': percentile(waits, 50),
+                    'queue_wait_p95': percentile(waits, 95),
+                }
+            return {
+                'policy': self.policy,
+                'workers': self.workers,
+                'pending': len(self._pending),
+                'running': len(self._running),
+                'seconds_per_cost': self._seconds_per_cost,
+                'event_weights': dict(self._event_weights),
+                'policies': per_policy,
+            }
@@ -1,5 +1,5 @@
 """
-Background task for zipping matched images, uploading to Supabase, and emailing results to the user.
+Background task for zipping matched images, storing them with the result storage backend, and emailing results to the user.
 """
 import os
 import zipfile
@@ -7,10 +7,13 @@ import tempfile
 import multiprocessing
 multiprocessing.set_start_method('forkserver', force=True)
 from context import supabase, mail, Message
+from result_storage import create_result_storage
+
+result_storage = create_result_storage(supabase, secret_key=os.getenv('SECRET_KEY'))
 
 def process_user_request(request_id):
     """
-    Processes a user request to zip matched images, upload to Supabase, and send email.
+    Processes a user request to zip matched images, store the zip, and send email.
     Args:
         request_id (str): The unique ID of the user request.
     """
@@ -42,15 +45,9 @@ def process_user_request(request_id):
                     new_name = f"matched_{idx}{ext}"
                     zipf.write(file_path, new_name)
             zip_path = tmp_zip.name
-        # Upload the zip to Supabase Storage
-        bucket_name = "matched-results"
+        # Store the zip and get its download URL
         zip_filename = f"matched_{recipient.replace('@', '_').replace('.', '_')}_{request_id}.zip"
-        with open(zip_path, "rb") as f:
-            upload_response = supabase.storage.from_(bucket_name).upload(
-                zip_filename, f, {"content-type": "application/zip", "x-upsert": "true"}
-            )
-        # Get the public URL for the uploaded zip
-        public_url = supabase.storage.from_(bucket_name).get_public_url(zip_filename)
+        public_url = result_storage.save(zip_path, zip_filename)
         # Send the email with the download link
         msg = Message("Face Match Results", recipients=[recipient])
         msg.body = f"\U0001F4C1 Your matched images are here:\n\n{public_url}"
@@ -61,8 +58,9 @@ def process_user_request(request_id):
             'status': 'done',
             'error_message': ''
         }).eq('id', request_id).execute()
-        # Clean up the temporary zip file
-        os.remove(zip_path)
+        # Clean up the temporary zip file (the local backend has already moved it)
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
     except Exception as e:
         # On error, mark the request as error and log the reason
         supabase.table('user_requests').update({'status': 'error', 'error_message': str(e)}).eq('id', request_id).execute()
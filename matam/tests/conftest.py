@@ -0,0 +1,7 @@
+"""
+Test configuration: the app's modules live in the matam/ folder and import each other by module name.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+"""
+Recall of the IVF / IVF-PQ index against exact 0.45-threshold search, on a synthetic gallery where identities
+are close enough that neighbourhoods straddle IVF lists (unlike real face encodings, which separate better).
+"""
+import numpy as np
+import pytest
+
+import ann_index
+from ann_index import ANN_NPROBE, IVFIndex, build_ann_index, squared_distances
+
+THRESHOLD = 0.45
+RECALL_FLOOR = 0.95
+DIM = 128
+
+@pytest.fixture(scope='module')
+def gallery():
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(1000, DIM)) * (0.35 / np.sqrt(DIM))
+    who = rng.integers(0, len(centres), 4000)
+    vectors = centres[who] + rng.normal(size=(len(who), DIM)) * (0.25 / np.sqrt(DIM))
+    queries = [centres[i] + rng.normal(size=(3, DIM)) * (0.25 / np.sqrt(DIM)) for i in range(30)]
+    return vectors, queries
+
+def exact_matches(vectors, queries):
+    return set(np.nonzero(np.sqrt(squared_distances(vectors, queries)).min(axis=1) < THRESHOLD)[0].tolist())
+
+def search(index, vectors, queries, nprobe):
+    rows, dists = index.range_search(queries, THRESHOLD, vectors, nprobe)
+    assert np.all(dists < THRESHOLD)
+    return set(rows.tolist())
+
+@pytest.fixture(scope='module', params=[0, 16], ids=['ivf', 'ivf-pq'])
+def index(request, gallery):
+    return IVFIndex(gallery[0], pq_subvectors=request.param)
+
+def test_recall_at_default_nprobe(index, gallery):
+    vectors, queries = gallery
+    truth = [exact_matches(vectors, q) for q in queries]
+    found = [search(index, vectors, q, ANN_NPROBE) for q in queries]
+    total = sum(len(t) for t in truth)
+    assert total > 50
+    assert sum(len(f & t) for f, t in zip(found, truth)) / total >= RECALL_FLOOR
+    assert sum(len(f - t) for f, t in zip(found, truth)) == 0
+
+def test_probing_every_list_is_exact(index, gallery):
+    vectors, queries = gallery
+    for q in queries:
+        assert search(index, vectors, q, index.nlist) == exact_matches(vectors, q)
+
+def test_incremental_keep_and_add_stay_exact(gallery):
+    vectors, queries = gallery
+    index = IVFIndex(vectors[:3000], pq_subvectors=16)
+    keep = np.arange(3000) % 3 != 0
+    index.keep(keep)
+    index.add(vectors[3000:])
+    current = np.vstack([vectors[:3000][keep], vectors[3000:]])
+    for q in queries[:10]:
+        assert search(index, current, q, index.nlist) == exact_matches(current, q)
+
+def test_small_or_disabled_galleries_use_exact_search(gallery, monkeypatch):
+    monkeypatch.setattr(ann_index, 'ANN_ENABLED', True)
+    monkeypatch.setattr(ann_index, 'ANN_MIN_FACES', len(gallery[0]) + 1)
+    assert build_ann_index(gallery[0]) is None
+    monkeypatch.setattr(ann_index, 'ANN_MIN_FACES', 10)
+    assert build_ann_index(gallery[0]) is not None
+    monkeypatch.setattr(ann_index, 'ANN_ENABLED', False)
+    assert build_ann_index(gallery[0]) is None
@@ -0,0 +1,33 @@
+"""
+Batched face descriptors must match face_recognition's per-image encodings.
+Needs dlib and face_recognition (with its models); skipped without them. Runs on the committed photos in
+tests/fixtures/ plus any listed in FACE_FIXTURE_IMAGES (separated by os.pathsep), and fails if they yield no faces.
+"""
+import glob
+import os
+import pytest
+
+face_recognition = pytest.importorskip('face_recognition')
+cv2 = pytest.importorskip('cv2')
+
+from face_encoding import ENCODING_TOLERANCE, compare_with_per_image
+
+FIXTURES_FOLDER = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def fixture_frames():
+    paths = [p for p in os.getenv('FACE_FIXTURE_IMAGES', '').split(os.pathsep) if p]
+    paths += sorted(glob.glob(os.path.join(FIXTURES_FOLDER, '*.jp*g')) + glob.glob(os.path.join(FIXTURES_FOLDER, '*.png')))
+    frames = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is not None:
+            frames.append((os.path.basename(path), cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+    return frames
+
+def test_batched_encodings_match_per_image():
+    frames = fixture_frames()
+    assert frames, 'No readable face fixture images in tests/fixtures/ or FACE_FIXTURE_IMAGES.'
+    (n_batched, n_single), max_diff = compare_with_per_image(frames, batch_size=3)
+    assert n_single > 0, 'No faces detected in the fixture images.'
+    assert n_batched == n_single
+    assert max_diff < ENCODING_TOLERANCE
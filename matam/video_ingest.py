@@ -0,0 +1,188 @@
+"""
+Video ingest for event galleries.
+Videos are decoded as a stream with cv2.VideoCapture and sampled into a small set of keyframes using
+scene-change and motion detection, with near-duplicate frames dropped. Keyframes are saved into the
+event gallery as still images (so the gallery index matches them like photos) and their source video
+and timestamp are recorded in a sidecar file so matches can report where in the video they occur.
+"""
+import json
+import os
+import threading
+import cv2
+import numpy as np
+
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v'}
+KEYFRAME_METADATA_FILE = '.video_keyframes.json'
+# Written next to matched images: {clean_filename: {'video': ..., 'timestamp': ...}}
+VIDEO_MATCHES_FILE = 'video_matches.json'
+
+# Frames analysed per second of video; the rest are only grabbed (not decoded to images)
+ANALYSIS_FPS = 4.0
+# Bhattacharyya distance between HSV histograms above which a frame starts a new scene
+SCENE_CHANGE_THRESHOLD = 0.35
+# Mean absolute grey-level difference (0-255) to the last keyframe that counts as significant motion
+MOTION_THRESHOLD = 18.0
+# Minimum seconds between motion keyframes within the same scene
+MIN_MOTION_GAP = 1.0
+# Keyframes whose 64-bit difference hashes are within this Hamming distance are near-duplicates
+DUPLICATE_HAMMING = 6
+# Number of recent keyframe hashes compared for near-duplicates
+DUPLICATE_WINDOW = 32
+
+_metadata_lock = threading.Lock()
+
+def is_video_file(filename):
+    """
+    Returns True if the filename has a supported video extension.
+    """
+    return os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS
+
+def difference_hash(gray):
+    """
+    64-bit difference hash of a greyscale frame, used to spot near-duplicate keyframes.
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def _hsv_histogram(frame):
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+def extract_keyframes(video_path, out_folder, prefix):
+    """
+    Streams a video and saves scene-aware, de-duplicated keyframes as JPEGs in out_folder.
+    A frame becomes a keyframe when it starts a new scene, or when it differs enough from the
+    last keyframe (motion) and MIN_MOTION_GAP has passed; near-duplicates of recent keyframes are dropped.
+    Args:
+        video_path (str): Path of the video file.
+        out_folder (str): Folder to write keyframes to (the event gallery).
+        prefix (str): Filename prefix for keyframes.
+    Returns:
+        dict: {keyframe_filename: timestamp_seconds}
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"❌ Could not open video: {video_path}")
+        return {}
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    stride = max(int(round(fps / ANALYSIS_FPS)), 1)
+    keyframes = {}
+    recent_hashes = []
+    prev_hist = None
+    last_key_gray = None
+    last_key_time = None
+    frame_idx = -1
+    analysed = 0
+    while True:
+        frame_idx += 1
+        if frame_idx % stride:
+            if not cap.grab():
+                break
+            continue
+        ok, frame = cap.read()
+        if not ok:
+            break
+        analysed += 1
+        timestamp = frame_idx / fps
+        small = cv2.resize(frame, (160, 90), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        hist = _hsv_histogram(small)
+        scene_change = prev_hist is None or \
+            cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > SCENE_CHANGE_THRESHOLD
+        prev_hist = hist
+        motion = last_key_gray is not None and \
+            timestamp - last_key_time >= MIN_MOTION_GAP and \
+            float(cv2.absdiff(gray, last_key_gray).mean()) > MOTION_THRESHOLD
+        if not scene_change and not motion:
+            continue
+        frame_hash = difference_hash(gray)
+        if any(bin(frame_hash ^ h).count('1') <= DUPLICATE_HAMMING for h in recent_hashes):
+            continue
+        recent_hashes = (recent_hashes + [frame_hash])[-DUPLICATE_WINDOW:]
+        last_key_gray = gray
+        last_key_time = timestamp
+        keyframe_name = f"{prefix}_t{int(timestamp * 1000):09d}.jpg"
+        cv2.imwrite(os.path.join(out_folder, keyframe_name), frame)
+        keyframes[keyframe_name] = round(timestamp, 3)
+    cap.release()
+    print(f"🎞️ {os.path.basename(video_path)}: kept {len(keyframes)} keyframes from {analysed} analysed frames.")
+    return keyframes
+
+def load_keyframe_metadata(gallery_folder):
+    """
+    Returns the keyframe metadata of an event gallery.
+    Returns:
+        dict: {keyframe_filename: {'video': source video name, 'timestamp': seconds}}
+    """
+    path = os.path.join(gallery_folder, KEYFRAME_METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def ingest_video(video_path, gallery_folder, original_name=None):
+    """
+    Extracts keyframes of a video into an event gallery and records their source video and timestamps.
+    The video file itself is removed afterwards; only the keyframes are kept for matching.
+    Args:
+        video_path (str): Path of the uploaded video.
+        gallery_folder (str): Event gallery folder.
+        original_name (str): Name to report for the video (defaults to the file name).
+    Returns:
+        int: Number of keyframes added.
+    """
+    original_name = original_name or os.path.basename(video_path)
+    stem = os.path.splitext(os.path.basename(original_name))[0]
+    prefix = f"video_{stem}_{os.urandom(3).hex()}"
+    try:
+        keyframes = extract_keyframes(video_path, gallery_folder, prefix)
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+    with _metadata_lock:
+        metadata = load_keyframe_metadata(gallery_folder)
+        metadata = {k: v for k, v in metadata.items() if os.path.exists(os.path.join(gallery_folder, k))}
+        for name, timestamp in keyframes.items():
+            metadata[name] = {'video': original_name, 'timestamp': timestamp}
+        tmp_path = os.path.join(gallery_folder, KEYFRAME_METADATA_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, os.path.join(gallery_folder, KEYFRAME_METADATA_FILE))
+    return len(keyframes)
+
+def save_video_matches(matched_folder, gallery_folder, matched_filenames):
+    """
+    Records which matched gallery images are video keyframes, with their source video and timestamp.
+    Args:
+        matched_folder (str): Folder the matched images were saved to.
+        gallery_folder (str): Event gallery folder the matches came from.
+        matched_filenames (list): Gallery filenames that matched.
+    Returns:
+        int: Number of matched keyframes.
+    """
+    metadata = load_keyframe_metadata(gallery_folder)
+    matches = {f"clean_{name}": metadata[name] for name in matched_filenames if name in metadata}
+    if matches:
+        with open(os.path.join(matched_folder, VIDEO_MATCHES_FILE), 'w') as f:
+            json.dump(matches, f)
+    return len(matches)
+
+def load_video_matches(matched_folder):
+    """
+    Returns the video keyframe matches saved by save_video_matches, keyed by clean_ filename.
+    """
+    path = os.path.join(matched_folder, VIDEO_MATCHES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def format_timestamp(seconds):
+    """
+    Formats seconds as H:MM:SS.s for result listings.
+    """
+    minutes, secs = divmod(float(seconds), 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours}:{minutes:02d}:{secs:04.1f}"